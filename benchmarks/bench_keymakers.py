@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Compares the cost of the memoize keymakers on typical arguments:
+a registry method receiving a list of Dependency objects, and a function
+receiving a few scalars and keyword arguments.
+
+    python benchmarks/bench_keymakers.py
+'''
+
+from __future__ import print_function, unicode_literals
+from timeit import timeit
+from mootiro_web.memoize import hashable_key, identity_key, pickle_key, dumps
+from mootiro_web.web_deps import DepsRegistry, Dependency
+
+
+def pickle0_key(args):
+    '''The default keymaker before pickle_key: protocol 0.'''
+    return dumps(args)
+
+
+def main():
+    reg = DepsRegistry()
+    deps = [Dependency('lib{}'.format(i)) for i in range(20)]
+    reg.admit(*deps)
+    reg.close()
+    cases = [
+        ('registry, 20 deps', ((reg, deps), {})),
+        ('scalars', ((42, 'pt_BR', 3), {})),
+        ('scalars + kwargs', ((42, 'pt_BR'), dict(fuzzy=True, n=3))),
+        ('list of scalars', ((['a', 'b', 'c'], 1), {})),
+    ]
+    keymakers = [('pickle 0', pickle0_key), ('pickle_key', pickle_key),
+                 ('repr', repr), ('hashable_key', hashable_key),
+                 ('identity_key', identity_key)]
+    print('{:<20}'.format('') + ''.join(
+        '{:>14}'.format(name) for name, k in keymakers))
+    for title, args in cases:
+        row = '{:<20}'.format(title)
+        for name, keymaker in keymakers:
+            try:
+                us = timeit(lambda: keymaker(args), number=20000) / 20000 * 1e6
+                row += '{:>11.2f} us'.format(us)
+            except Exception:  # e.g. pickling a registry
+                row += '{:>14}'.format('n/a')
+        print(row)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Compares the memoize decorator against the original implementation,
+which kept the order of use in a plain list (O(n) per hit and eviction).
+
+    python benchmarks/bench_memoize.py
+'''
+
+from __future__ import print_function, unicode_literals
+from functools import wraps
+from timeit import default_timer
+from mootiro_web.memoize import memoize
+
+
+def list_memoize(limit=None, keymaker=repr):
+    '''The original memoize, for comparison.'''
+    def decoratr(fn):
+        cache = {}
+        popular = []
+        @wraps(fn)
+        def wrapper(*a, **kw):
+            key = keymaker((a, kw))
+            try:
+                popular.append(popular.pop(popular.index(key)))
+            except ValueError:
+                cache[key] = fn(*a, **kw)
+                popular.append(key)
+                if limit is not None and len(popular) > limit:
+                    del cache[popular.pop(0)]
+            return cache[key]
+        return wrapper
+    return decoratr
+
+
+def measure(decorator, size, calls=20000):
+    '''Fills a cache of `size` entries, then times `calls` calls that
+    alternate between hits (spread over the whole cache) and misses
+    (which cause evictions). Returns microseconds per call.
+    '''
+    fn = decorator(size, keymaker=repr)(lambda n: n)
+    for n in range(size):
+        fn(n)
+    start = default_timer()
+    for i in range(calls):
+        if i % 2:
+            fn(size + i)  # miss, evicts the oldest entry
+        else:
+            fn((i * 7919) % size + i // 2)  # probably a hit
+    return (default_timer() - start) / calls * 1e6
+
+
+def main():
+    print('{:>8} {:>14} {:>14}'.format('size', 'list (us)', 'KeyOrder (us)'))
+    for size in (10, 100, 1000, 10000):
+        print('{:>8} {:>14.2f} {:>14.2f}'.format(size,
+            measure(list_memoize, size), measure(memoize, size)))
+
+
+if __name__ == '__main__':
+    main()
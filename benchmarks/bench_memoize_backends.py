@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Measures what sharing memoized values between processes costs:
+a hit in the default dict cache versus a hit in a FileCache,
+and how much of the latter is just (un)pickling the value.
+
+    python benchmarks/bench_memoize_backends.py
+'''
+
+from __future__ import print_function, unicode_literals
+from functools import partial
+from shutil import rmtree
+from tempfile import mkdtemp
+from timeit import timeit
+from mootiro_web.memoize import memoize, FileCache, dumps, loads
+
+NUMBER = 2000
+
+
+def per_call(fn):
+    return timeit(fn, number=NUMBER) / NUMBER * 1e6
+
+
+def main():
+    values = [
+        ('short string', 'Hello, world'),
+        ('20 KB of HTML', '<p>Lorem ipsum dolor sit amet.</p>\n' * 560),
+        ('1000 small dicts', [dict(id=i, name='item{}'.format(i))
+                              for i in range(1000)]),
+    ]
+    directory = mkdtemp()
+    try:
+        print('{:<18} {:>12} {:>12} {:>12} {:>12}'.format('value (us)',
+            'dict hit', 'file hit', 'file miss', 'pickling'))
+        for i, (title, value) in enumerate(values):
+            in_dict = memoize()(lambda: value)
+            cache_type = partial(FileCache, '{}/{}'.format(directory, i))
+            in_file = memoize(cache_type=cache_type)(lambda: value)
+            in_dict()
+            in_file()
+
+            def miss():
+                in_file.cache.clear()
+                in_file()
+            print('{:<18} {:>12.2f} {:>12.2f} {:>12.2f} {:>12.2f}'.format(
+                title, per_call(in_dict), per_call(in_file), per_call(miss),
+                per_call(lambda: loads(dumps(value, 2)))))
+    finally:
+        rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
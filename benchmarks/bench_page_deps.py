@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Measures the cost of a typical request of an application that still
+uses the page_deps API: create a page, require a package, some libraries
+and stylesheets, then output the HTML. Compares page_deps.DepsRegistry
+to FastDepsRegistry, which runs on the memoized web_deps engine,
+for registries of increasing size.
+
+    python benchmarks/bench_page_deps.py
+'''
+
+from __future__ import print_function, unicode_literals
+import random
+import warnings
+from timeit import repeat
+from mootiro_web.page_deps import DepsRegistry, FastDepsRegistry, PageDeps
+
+
+def declare(registry, libs, stylesheets):
+    rnd = random.Random(42)
+    for i in range(libs):
+        registry.lib('lib{}'.format(i), '/static/lib{}.js'.format(i),
+            depends=['lib{}'.format(j) for j in
+                     rnd.sample(range(i), min(i, 3))])
+    for i in range(stylesheets):
+        registry.stylesheet('css{}'.format(i), '/static/{}.css'.format(i))
+    registry.package('page', libs=['lib{}'.format(libs - 1)],
+                     css=['css{}'.format(stylesheets - 1)], onload='go();')
+    return registry
+
+
+def request(registry, libs, stylesheets):
+    page = getattr(registry, 'page_class', PageDeps)(registry)
+    page.package('page')
+    page.libs(['lib{}'.format(i) for i in range(libs // 2, libs, 4)])
+    page.stylesheets(['css{}'.format(i) for i in range(0, stylesheets, 2)])
+    return unicode(page)
+
+
+def main():
+    warnings.simplefilter('ignore')
+    for libs, stylesheets in ((10, 5), (40, 15), (80, 30)):
+        old = declare(DepsRegistry(), libs, stylesheets)
+        fast = declare(FastDepsRegistry(), libs, stylesheets)
+        request(fast, libs, stylesheets)  # builds the engine
+        times = [min(repeat(lambda: request(r, libs, stylesheets),
+                            number=200, repeat=5)) / 200 for r in (old, fast)]
+        print('{:>3} libs, {:>2} stylesheets: old {:>8.1f} us   '
+              'fast {:>6.1f} us'.format(libs, stylesheets,
+                                         *[t * 1e6 for t in times]))
+
+
+if __name__ == '__main__':
+    main()
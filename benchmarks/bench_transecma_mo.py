@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Measures loading a synthetic catalog of 20,000 messages as a
+dictionary: transecma.po2dict() parses the .po file through Babel,
+transecma.mo2dict() memory-maps the compiled .mo file, and the
+standard library's gettext.GNUTranslations is shown for comparison.
+
+    python benchmarks/bench_transecma_mo.py
+'''
+
+from __future__ import print_function, unicode_literals
+import gettext
+import io
+import os
+from shutil import rmtree
+from struct import pack
+from tempfile import mkdtemp
+from timeit import timeit
+from mootiro_web.transecma import mo2dict, po2dict
+
+MESSAGES = 20000
+HEADER = 'Content-Type: text/plain; charset=UTF-8\n'
+
+
+def make_messages():
+    return [('Message number {} of the synthetic catalog'.format(i),
+             'Mensagem número {} do catálogo sintético'.format(i))
+            for i in range(MESSAGES)]
+
+
+def write_po(path, messages):
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write('msgid ""\nmsgstr ""\n"{}"\n\n'.format(
+            HEADER.replace('\n', '\\n')))
+        for msgid, msgstr in messages:
+            f.write('msgid "{}"\nmsgstr "{}"\n\n'.format(msgid, msgstr))
+
+
+def write_mo(path, messages):
+    messages = sorted([(b'', HEADER.encode('utf-8'))] +
+        [(k.encode('utf-8'), v.encode('utf-8')) for k, v in messages])
+    count = len(messages)
+    offset = 28 + 16 * count
+    tables, data = ([], []), []
+    for index in (0, 1):
+        for message in messages:
+            tables[index].append(pack(b'<2I', len(message[index]), offset))
+            data.append(message[index] + b'\0')
+            offset += len(message[index]) + 1
+    with open(path, 'wb') as f:
+        f.write(pack(b'<7I', 0x950412de, 0, count, 28, 28 + 8 * count, 0, 0))
+        f.write(b''.join(tables[0] + tables[1] + data))
+
+
+def load_gnu(path):
+    with open(path, 'rb') as f:
+        return gettext.GNUTranslations(f)
+
+
+def main():
+    directory = mkdtemp()
+    try:
+        messages = make_messages()
+        po_path = os.path.join(directory, 'big.po')
+        mo_path = os.path.join(directory, 'big.mo')
+        write_po(po_path, messages)
+        write_mo(mo_path, messages)
+        assert len(mo2dict(mo_path)) == MESSAGES + 1
+        print('mo2dict():           {:>8.1f} ms'.format(
+            timeit(lambda: mo2dict(mo_path), number=10) * 100))
+        print('GNUTranslations:     {:>8.1f} ms'.format(
+            timeit(lambda: load_gnu(mo_path), number=10) * 100))
+        try:
+            import babel
+        except ImportError:
+            print('po2dict():           Babel is not installed')
+        else:
+            def parse_po():
+                with open(po_path, 'rb') as f:
+                    return po2dict(f, 'pt_BR')
+            print('po2dict():           {:>8.1f} ms'.format(
+                timeit(parse_po, number=1) * 1000))
+    finally:
+        rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
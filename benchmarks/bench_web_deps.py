@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Measures DepsRegistry.summon() on a synthetic asset graph of 500 nodes
+in 10 layers, where each node depends on 3 nodes of the layer below
+(lots of diamonds). Compares the original algorithm -- a recursive walk
+followed by uniquefy(reversed(flat)) -- to the closures precomputed
+by close(). The cache is bypassed (_summon.func) to measure misses.
+
+    python benchmarks/bench_web_deps.py
+'''
+
+from __future__ import print_function, unicode_literals
+import random
+from timeit import timeit
+from mootiro_web.web_deps import DepsRegistry, Dependency, uniquefy
+
+LAYERS, WIDTH, FAN_OUT = 10, 50, 3
+
+
+def recursive_deps(dep):
+    flat = [dep]
+    for d in dep.deps:
+        flat.extend(recursive_deps(d))
+    return flat
+
+
+def old_summon(items):
+    flat = []
+    for item in items:
+        flat.extend(recursive_deps(item))
+    return uniquefy(reversed(flat))
+
+
+def make_registry():
+    rnd = random.Random(42)
+    reg = DepsRegistry()
+    for layer in range(LAYERS):
+        for i in range(WIDTH):
+            deps = ['n{}_{}'.format(layer - 1, j) for j in
+                    rnd.sample(range(WIDTH), FAN_OUT)] if layer else ''
+            reg.admit(Dependency('n{}_{}'.format(layer, i), deps=deps))
+    return reg
+
+
+def main():
+    reg = make_registry()
+    print('close(): {:.1f} ms'.format(timeit(
+        lambda: make_registry().close(), number=5) / 5 * 1000))
+    reg.close()
+    summon = lambda reg, items: DepsRegistry._summon.func(
+        reg, reg.requirement(items))
+    for layer in (2, 5, 9):
+        for k in (1, 5):
+            items = [reg.items['n{}_{}'.format(layer, i)] for i in range(k)]
+            assert set(old_summon(items)) == set(summon(reg, items))
+            number = 3 if layer == 9 else 100
+            old = timeit(lambda: old_summon(items), number=number) / number
+            new = timeit(lambda: summon(reg, items), number=100) / 100
+            print('layer {}, {} handles: old {:>10.1f} us   new {:>7.1f} us'
+                  .format(layer, k, old * 1e6, new * 1e6))
+
+
+if __name__ == '__main__':
+    main()
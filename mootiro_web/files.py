@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals  # unicode by default
+
+'''Small helpers for files that several processes read and write.'''
+
+import os
+
+
+def hash_file(path):
+    '''Returns the sha1 hex digest of the file at `path`, read in blocks.'''
+    from hashlib import sha1
+    digest = sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def atomic_write(path, content, prefix='.tmp'):
+    '''Writes `content` (bytes, or text to be encoded as UTF-8) to a
+    temporary file next to `path` and then renames it over `path`, so
+    other processes never read half a file.
+    '''
+    from tempfile import mkstemp
+    if not isinstance(content, bytes):
+        content = content.encode('utf8')
+    fd, temp_path = mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                            prefix=prefix)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        getattr(os, 'replace', os.rename)(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
@@ -1,45 +1,589 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals  # unicode by default
-from functools import wraps
+from functools import partial, wraps
+from hashlib import sha1
+import inspect
+import os
+import sys
+import threading
+import time
+from weakref import WeakSet
 # Instead of wrapper.__doc__ = f.__doc__ and wrapper.__name__ = f.__name__,
 # use functools.wraps.
 
+now = getattr(time, 'monotonic', time.time)  # the clock used for ttl
+# Coroutine functions only exist in Python 3.5+
+iscoroutinefunction = getattr(inspect, 'iscoroutinefunction', lambda f: False)
+PREV, NEXT, KEY = 0, 1, 2  # names for the fields of a link in KeyOrder
 
-def memoize(limit=None, keymaker=None, cache_type=dict, debug=False):
+
+class KeyOrder(object):
+    '''Remembers the order in which keys were last used, least recently used
+    first. It is a linked hash set: a dict maps each key to a link in a
+    circular doubly linked list, so that pushing a key (new or old),
+    discarding a key and popping the oldest key are all O(1) operations.
+    '''
+    def __init__(self):
+        self._map = {}
+        self._root = root = []
+        root[:] = [root, root, None]
+
+    def __len__(self):
+        return len(self._map)
+
+    def __contains__(self, key):
+        return key in self._map
+
+    def __iter__(self):
+        '''Iterates over the keys, least recently used first.'''
+        root = self._root
+        link = root[NEXT]
+        while link is not root:
+            yield link[KEY]
+            link = link[NEXT]
+
+    def push(self, key):
+        '''Marks `key` as the most recently used one, adding it if needed.'''
+        root = self._root
+        link = self._map.get(key)
+        if link is None:
+            last = root[PREV]
+            last[NEXT] = root[PREV] = self._map[key] = [last, root, key]
+        elif link is not root[PREV]:
+            link_prev, link_next = link[PREV], link[NEXT]
+            link_prev[NEXT] = link_next
+            link_next[PREV] = link_prev
+            last = root[PREV]
+            link[PREV] = last
+            link[NEXT] = root
+            last[NEXT] = root[PREV] = link
+
+    @property
+    def oldest(self):
+        '''The least recently used key.'''
+        link = self._root[NEXT]
+        if link is self._root:
+            raise KeyError('KeyOrder is empty.')
+        return link[KEY]
+
+    def discard(self, key):
+        '''Forgets `key` if it is present.'''
+        link = self._map.pop(key, None)
+        if link is not None:
+            link_prev, link_next = link[PREV], link[NEXT]
+            link_prev[NEXT] = link_next
+            link_next[PREV] = link_prev
+
+    def pop_oldest(self):
+        '''Removes and returns the least recently used key.'''
+        key = self.oldest
+        self.discard(key)
+        return key
+
+    def clear(self):
+        self._map.clear()
+        root = self._root
+        root[:] = [root, root, None]
+
+
+try:
+    from cPickle import dumps, loads, Pickler
+except ImportError:
+    from pickle import dumps, loads, Pickler
+
+
+def stable_dumps(o, protocol=2):
+    '''Pickles `o` without the memo, so equal keys always give the same
+    bytes (cPickle only memoizes objects that have other references).
+    Recursive structures are not supported.
+    '''
+    from io import BytesIO
+    f = BytesIO()
+    pickler = Pickler(f, protocol)
+    pickler.fast = True
+    pickler.dump(o)
+    return f.getvalue()
+
+
+class KW_MARK(object):
+    '''Separates positional from keyword arguments in cache keys.
+    The class itself is the marker; unlike an instance, it pickles
+    to the same thing in every process.
+    '''
+
+try:
+    SCALARS = frozenset([str, unicode, int, long, float, bool, type(None)])
+except NameError:  # Python 3
+    SCALARS = frozenset([str, bytes, int, float, bool, type(None)])
+CONTAINERS = frozenset([tuple, list, dict, set, frozenset])
+
+
+def freeze(o, strict=False):
+    '''Returns a hashable version of `o`: lists become tuples, dicts and
+    sets become frozensets, recursively. Other objects are returned as they
+    are -- or, if `strict`, cause a TypeError.
+    '''
+    typ = type(o)
+    if typ in SCALARS:
+        return o
+    if typ is tuple:
+        return tuple([freeze(i, strict) for i in o])
+    if typ is list:
+        return (list, tuple([freeze(i, strict) for i in o]))
+    if typ is dict:
+        return (dict, frozenset(
+            [(k, freeze(v, strict)) for k, v in o.items()]))
+    if typ is set or typ is frozenset:
+        return (typ, frozenset([freeze(i, strict) for i in o]))
+    if strict:
+        raise TypeError('Not a scalar: {!r}'.format(o))
+    return o
+
+
+def hashable_key(args, strict=False):
+    '''Keymaker that builds a tuple out of the arguments, freezing
+    lists, dicts and sets. Keyword arguments are sorted by name.
+    Like in dicts, 1, 1.0 and True are the same key.
+    '''
+    a, kw = args
+    key = a
+    for o in a:  # Usually there are no containers; then no copy is made
+        typ = type(o)
+        if typ in CONTAINERS or (strict and typ not in SCALARS):
+            key = freeze(a, strict)
+            break
+    if kw:
+        key += (KW_MARK,) + tuple(sorted(
+            [(k, freeze(v, strict)) for k, v in kw.items()]))
+    return key
+
+
+def _identify(o):
+    typ = type(o)
+    if typ in SCALARS:
+        return o
+    if typ is list or typ is tuple:
+        return (typ, tuple([i if type(i) in SCALARS else id(i) for i in o]))
+    return id(o)
+
+
+def identity_key(args):
+    '''Keymaker that uses the identity -- id() -- of the arguments,
+    except for strings and numbers, which are used by value.
+    The items of lists and tuples are identified one by one, by the
+    same rule.
+
+    This is the cheapest keymaker, but it is only correct for objects
+    that live longer than the cache, such as registries and their
+    Dependency instances, because id() values are reused after an
+    object is garbage collected.
+    '''
+    a, kw = args
+    key = tuple([_identify(o) for o in a])
+    if kw:
+        key += (KW_MARK,) + tuple(sorted(
+            [(k, _identify(v)) for k, v in kw.items()]))
+    return key
+
+
+def pickle_key(args):
+    '''Default keymaker. Pickles the arguments, which compares arbitrary
+    objects by value (and 1, 1.0 and True as different keys). Protocol 2
+    is the fastest in both Python 2 and 3; per bench_keymakers.py, the
+    C pickler beats any keymaker written in Python except for plain
+    scalars, where hashable_key wins. Keyword arguments are sorted.
+    '''
+    a, kw = args
+    if kw:
+        return dumps((a, sorted(kw.items())), 2)
+    return dumps(a, 2)
+
+
+class FileCache(object):
+    '''A cache_type for memoize that keeps each value, pickled, in a file
+    inside `directory`, so sibling worker processes (of gunicorn, uwsgi
+    etc.) reuse each other's values instead of computing them again:
+
+        from functools import partial
+        @memoize(cache_type=partial(FileCache, '/var/cache/myapp/prices'))
+        def price(product_id):
+            ...
+
+    Use one directory per memoized function, because keys do not include
+    the function. The keys must pickle the same way in every process,
+    so do not use identity_key with a FileCache.
+
+    Writes go to a temporary file which is then renamed, so readers
+    never see half a value and no locking is needed. Values are only
+    removed when evicted by memoize (limit, ttl, max_bytes) or by clear().
+    The age of a value, for `ttl`, is that of its file, so values stored
+    by another process expire too.
+    '''
+    TEMP_PREFIX = '.tmp'
+
+    def __init__(self, directory, protocol=2):
+        self.directory = directory
+        self.protocol = protocol
+        try:
+            os.makedirs(directory)
+        except OSError:  # Probably created by a sibling process
+            if not os.path.isdir(directory):
+                raise
+
+    def path(self, key):
+        return os.path.join(self.directory,
+                            sha1(stable_dumps(key, self.protocol)).hexdigest())
+
+    def __getitem__(self, key):
+        try:
+            with open(self.path(key), 'rb') as f:
+                content = f.read()
+        except EnvironmentError:
+            raise KeyError(key)
+        return loads(content)
+
+    def __setitem__(self, key, value):
+        from .files import atomic_write
+        atomic_write(self.path(key), dumps(value, self.protocol),
+                     prefix=self.TEMP_PREFIX)
+
+    def __delitem__(self, key):
+        try:
+            os.remove(self.path(key))
+        except EnvironmentError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def stored_at(self, key):
+        '''Returns when the value was stored (by any process), as a
+        time.time() timestamp, or None. memoize uses it to apply `ttl`.
+        '''
+        try:
+            return os.path.getmtime(self.path(key))
+        except EnvironmentError:
+            return None
+
+    def __len__(self):
+        return len([n for n in os.listdir(self.directory)
+                    if not n.startswith(self.TEMP_PREFIX)])
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+            del self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        return value
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except EnvironmentError:
+                pass
+
+
+class Flight(object):
+    '''A computation in progress, which other threads can wait for.
+    If it was `interrupted` (by a BaseException such as KeyboardInterrupt
+    or GreenletExit), there is no value and the waiters must try again.
+    '''
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = self.error = None
+        self.interrupted = False
+
+    def land(self, value=None, error=None, interrupted=False):
+        self.value, self.error = value, error
+        self.interrupted = interrupted
+        self.event.set()
+
+    def wait(self):
+        self.event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class CacheStats(object):
+    '''Counters of one memoized function, available as `wrapper.stats`.
+    Callers that wait for a value being computed by another thread
+    count as hits. `compute_time` is the total number of seconds spent
+    in the memoized function itself.
+    '''
+    def __init__(self, name, cache):
+        self.name = name
+        self.cache = cache
+        self.bytes = 0  # only measured when there is a max_bytes
+        self.reset()
+
+    def reset(self):
+        self.hits = self.misses = self.evictions = 0
+        self.compute_time = 0.0
+
+    @property
+    def size(self):
+        return len(self.cache)
+
+    @property
+    def hit_ratio(self):
+        calls = self.hits + self.misses
+        return float(self.hits) / calls if calls else 0.0
+
+    def as_dict(self):
+        return dict(name=self.name, hits=self.hits, misses=self.misses,
+            evictions=self.evictions, size=self.size, bytes=self.bytes,
+            hit_ratio=self.hit_ratio, compute_time=self.compute_time)
+
+
+memoized = WeakSet()  # every function decorated with memoize
+
+
+def all_stats():
+    '''Returns the CacheStats of every memoized function, sorted by name.'''
+    return sorted([f.stats for f in memoized], key=lambda s: s.name)
+
+
+def stats_report():
+    '''Returns a plain text table with the statistics of every
+    memoized function, e.g. for a debug view.
+    '''
+    line = '{:<50} {:>9} {:>9} {:>6} {:>9} {:>7} {:>10} {:>9}'
+    rows = [line.format('function', 'hits', 'misses', 'ratio', 'evictions',
+                        'size', 'bytes', 'seconds')]
+    for s in all_stats():
+        rows.append(line.format(s.name, s.hits, s.misses,
+            '{:.1%}'.format(s.hit_ratio), s.evictions, s.size, s.bytes,
+            '{:.3f}'.format(s.compute_time)))
+    return '\n'.join(rows)
+
+
+class Ready(object):
+    '''An awaitable that is already done: awaiting it returns `value`
+    without involving the event loop. Returned by memoized coroutine
+    functions on cache hits.
+    '''
+    def __init__(self, value):
+        self.value = value
+
+    def __await__(self):
+        return self
+
+    __iter__ = __await__  # for "yield from"
+
+    def __next__(self):
+        raise StopIteration(self.value)
+
+    next = __next__
+
+
+def memoize(limit=None, keymaker=None, cache_type=dict, debug=False,
+            lock=False, ttl=None, max_bytes=None, sizeof=sys.getsizeof):
     '''memoize decorator with a lru cache.
     When full, the cache discards the least recently used value.
-    You can pass cache_type=WeakValueDictionary (not tested).
+    You can pass cache_type=WeakValueDictionary (not tested), or
+    a FileCache to share the values between processes.
+
+    Values are stored in `wrapper.cache`, an instance of `cache_type`.
+    When there is a `limit`, the order of use is kept in `wrapper.popular`,
+    a KeyOrder, so cache hits and evictions cost O(1) regardless of
+    the size of the cache.
+
+    `keymaker` receives a tuple (args, kwargs) and returns the cache key.
+    The default is pickle_key; see also hashable_key and identity_key.
+
+    Pass lock=True if the function is called from several threads.
+    Then the cache is protected by a lock and, when many threads miss
+    the same key at once, only the first one calls the function;
+    the others wait for its result (or its exception).
+
+    A value older than `ttl` seconds is computed again.
+    `max_bytes` bounds the approximate memory used by the cached values,
+    as measured by `sizeof` -- by default sys.getsizeof(), which does not
+    look inside containers, so pass your own callable for those,
+    e.g. `sizeof=len` for strings. Least recently used values are
+    discarded first. `limit`, `ttl` and `max_bytes` can be combined.
+
+    Coroutine functions (async def) are supported: the wrapper returns
+    an awaitable and caches the result, not the coroutine. Concurrent
+    callers with the same key share one asyncio task, so `lock` is
+    unnecessary for them. A failed or cancelled task is not cached.
+
+    Hits, misses etc. are counted in `wrapper.stats`, a CacheStats.
+    Every memoized function is listed in the module variable `memoized`;
+    stats_report() shows them all.
     '''
-    if not keymaker:
-        try:
-            from cPickle import dumps
-        except ImportError:
-            from pickle import dumps
-        keymaker = lambda *a, **kw: dumps((a, kw))
+    keymaker = keymaker or pickle_key
     def decoratr(fn):
         cache = cache_type()
-        popular = []
-        @wraps(fn)
-        def wrapper(*a, **kw):
-            key = keymaker((a, kw))
+        popular = KeyOrder()
+        track = limit is not None or max_bytes is not None
+        births = KeyOrder()  # order of storage, for expiring by ttl
+        deadlines = {}
+        stored_at = getattr(cache, 'stored_at', None)  # e.g. a FileCache
+        sizes = {}
+        stats = CacheStats('{}.{}'.format(fn.__module__,
+            getattr(fn, '__qualname__', fn.__name__)), cache)
+
+        def evict(key):
             try:
-                popular.append(popular.pop(popular.index(key)))
-            except ValueError:
-                cache[key] = fn(*a, **kw)
-                popular.append(key)
-                if limit is not None and len(popular) > limit:
-                    del cache[popular.pop(0)]
-            else:
-                if debug:
-                    print('Hit cache of {}(). Value:\n  {}' \
-                        .format(fn.__name__, key))
-            return cache[key]
+                del cache[key]
+            except KeyError:
+                pass
+            stats.evictions += 1
+            popular.discard(key)
+            if ttl is not None:
+                births.discard(key)
+                deadlines.pop(key, None)
+            if max_bytes is not None:
+                stats.bytes -= sizes.pop(key, 0)
+
+        def lookup(key):
+            '''Returns the cached value or raises KeyError.'''
+            if ttl is not None:
+                deadline = deadlines.get(key)
+                expired = deadline is not None and deadline <= now()
+                if not expired and stored_at is not None:
+                    # The value may have been stored by another process
+                    moment = stored_at(key)
+                    expired = moment is not None and \
+                        moment + ttl <= time.time()
+                if expired:
+                    evict(key)
+                    raise KeyError(key)
+            value = cache[key]
+            stats.hits += 1
+            if track:
+                popular.push(key)
+            if debug:
+                print('Hit cache of {}(). Value:\n  {}' \
+                    .format(fn.__name__, key))
+            return value
+
+        def store(key, value):
+            cache[key] = value
+            if ttl is not None:
+                moment = now()
+                # Values expire in the order they were stored
+                while births and deadlines[births.oldest] <= moment:
+                    evict(births.pop_oldest())
+                births.discard(key)
+                births.push(key)
+                deadlines[key] = moment + ttl
+            if max_bytes is not None:
+                size = sizeof(value)
+                stats.bytes += size - sizes.get(key, 0)
+                sizes[key] = size
+            if track:
+                popular.push(key)
+                while limit is not None and len(popular) > limit:
+                    evict(popular.oldest)
+                while max_bytes is not None and stats.bytes > max_bytes:
+                    evict(popular.oldest)
+
+        if iscoroutinefunction(fn):
+            import asyncio
+            tasks = {}  # computations in progress, by key
+
+            def land(key, start, task):
+                del tasks[key]
+                stats.compute_time += now() - start
+                if not task.cancelled() and task.exception() is None:
+                    store(key, task.result())
+
+            @wraps(fn)
+            def wrapper(*a, **kw):
+                key = keymaker((a, kw))
+                try:
+                    return Ready(lookup(key))
+                except KeyError:
+                    task = tasks.get(key)
+                    if task is None:
+                        stats.misses += 1
+                        task = tasks[key] = asyncio.ensure_future(
+                            fn(*a, **kw))
+                        task.add_done_callback(partial(land, key, now()))
+                    else:
+                        stats.hits += 1
+                    # One caller being cancelled must not cancel the others
+                    return asyncio.shield(task)
+        elif lock:
+            mutex = threading.Lock()
+            flights = {}  # computations in progress, by key
+            @wraps(fn)
+            def wrapper(*a, **kw):
+                key = keymaker((a, kw))
+                while True:
+                    with mutex:
+                        try:
+                            return lookup(key)
+                        except KeyError:
+                            flight = flights.get(key)
+                            leader = flight is None
+                            if leader:
+                                stats.misses += 1
+                                flight = flights[key] = Flight()
+                            else:
+                                stats.hits += 1
+                    if leader:
+                        break
+                    value = flight.wait()
+                    if not flight.interrupted:
+                        return value
+                start = now()
+                try:
+                    value = fn(*a, **kw)
+                except BaseException as e:
+                    with mutex:
+                        stats.compute_time += now() - start
+                        del flights[key]
+                    # Waiters share ordinary errors, but if the leader was
+                    # interrupted (e.g. GreenletExit), they try again.
+                    if isinstance(e, Exception):
+                        flight.land(error=e)
+                    else:
+                        flight.land(interrupted=True)
+                    raise
+                with mutex:
+                    stats.compute_time += now() - start
+                    store(key, value)
+                    del flights[key]
+                flight.land(value)
+                return value
+            wrapper.lock = mutex
+        else:
+            @wraps(fn)
+            def wrapper(*a, **kw):
+                key = keymaker((a, kw))
+                try:
+                    return lookup(key)
+                except KeyError:
+                    stats.misses += 1
+                    start = now()
+                    try:
+                        value = fn(*a, **kw)
+                    finally:
+                        stats.compute_time += now() - start
+                    store(key, value)
+                    return value
 
         wrapper.cache = cache
         wrapper.popular = popular
         wrapper.limit = limit
         wrapper.func = fn
+        wrapper.stats = stats
+        memoized.add(wrapper)
         return wrapper
     return decoratr
 
@@ -4,6 +4,8 @@
 '''page_deps.py
 
 This module is obsolete. Use *web_deps* instead.
+Until you migrate, replace DepsRegistry with FastDepsRegistry, which
+keeps this API but computes the pages with the faster web_deps engine.
 
 Copyright © 2011 Nando Florestan
 with thanks to Tiago Fassoni and Edgar Alvarenga for valuable feedback.
@@ -216,6 +218,7 @@ try:
     from cStringIO import StringIO
 except ImportError:
     from StringIO import StringIO
+from .web_deps import PageDepsComponent, WebDeps
 
 try:
     from functools import total_ordering
@@ -502,6 +505,110 @@ class PageDeps(object):
                           self.out_onloads(tag=True)])
 
 
+class FastPageDeps(PageDeps):
+    '''Same API as PageDeps, but backed by the web_deps engine, whose
+    results are memoized: adding a requirement is O(1) and the sorted
+    URLs and HTML tags are only computed once per distinct set of
+    requirements. Instantiated like PageDeps, with a FastDepsRegistry.
+
+    Unlike PageDeps, libraries are output in the order in which they
+    were registered, which is also a valid order, since registration
+    must be done bottom-up.
+    '''
+    def __init__(self, registry):
+        self._reg = registry
+        # Only lock when the engine has to be built
+        engine = registry._engine or registry.engine
+        self._lib_req = PageDepsComponent(engine.lib)
+        self._css_req = PageDepsComponent(engine.css)
+        self.onloads = []
+
+    def lib(self, name):
+        '''Adds a requirement of a javascript library to this page.'''
+        self._lib_req([name])
+
+    def libs(self, names):
+        '''Adds requirements for one or more javascript libraries.'''
+        if isinstance(names, basestring):
+            names = names.split('|')
+        self._lib_req(names)
+
+    @property
+    def sorted_libs(self):
+        return self._lib_req.urls
+
+    @property
+    def out_libs(self):
+        return self._lib_req.tags
+
+    def stylesheet(self, name):
+        '''Adds a requirement of a CSS stylesheet to this page.'''
+        self._css_req([name])
+
+    def stylesheets(self, names):
+        '''Adds requirements for a few CSS stylesheets to this page.'''
+        if isinstance(names, basestring):
+            names = names.split('|')
+        self._css_req(names)
+
+    @property
+    def sorted_stylesheets(self):
+        return self._css_req.urls
+
+    @property
+    def out_stylesheets(self):
+        return self._css_req.tags
+
+
+class FastDepsRegistry(DepsRegistry):
+    '''A drop-in replacement for DepsRegistry, for applications that
+    still use the page_deps API, e.g. through
+    mootiro_web.user.get_request_class(). Its pages are FastPageDeps
+    instances. When the first page is created, the registered
+    libraries and stylesheets are declared to a web_deps.WebDeps,
+    stylesheets in the order of their priorities.
+    '''
+    page_class = FastPageDeps
+
+    def __init__(self, *a, **kw):
+        super(FastDepsRegistry, self).__init__(*a, **kw)
+        self._lib_order = []
+        self._css_order = []
+        self._engine = None
+        from threading import Lock
+        self._lock = Lock()
+
+    def lib(self, name, urls, depends=[]):
+        super(FastDepsRegistry, self).lib(name, urls, depends=depends)
+        if name not in self._lib_order:
+            self._lib_order.append(name)
+        self._engine = None
+
+    def stylesheet(self, name, urls, priority=None):
+        super(FastDepsRegistry, self).stylesheet(name, urls,
+                                                 priority=priority)
+        if name not in self._css_order:
+            self._css_order.append(name)
+        self._engine = None
+
+    @property
+    def engine(self):
+        '''The closed web_deps.WebDeps holding the registrations.'''
+        with self._lock:
+            if self._engine is None:
+                deps = WebDeps()
+                for name in self._lib_order:
+                    lib = self._libs[name]
+                    deps.lib(name, url=lib.url,
+                             deps=[d.name for d in lib.dependencies])
+                for name in sorted(self._css_order,  # sort is stable
+                                   key=lambda n: self._css[n].priority):
+                    deps.css(name, url=self._css[name].url)
+                deps.close()
+                self._engine = deps
+            return self._engine
+
+
 '''Tests'''
 if __name__ == '__main__':
     r = DepsRegistry()
@@ -529,7 +636,7 @@ if __name__ == '__main__':
     print(unicode(p))
 
 
-__all__ = ['DepsRegistry', 'PageDeps']
+__all__ = ['DepsRegistry', 'PageDeps', 'FastDepsRegistry', 'FastPageDeps']
 
 
 __feedback__ = '''
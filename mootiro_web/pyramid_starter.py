@@ -224,6 +224,58 @@ class PyramidStarter(object):
         self.config.add_route('robots', '/robots.txt')
         self.config.add_view(robots_view, route_name='robots')
 
+    def enable_bundles(self, bundler):
+        '''Serves the bundles made by a web_deps.Bundler
+        under its url_prefix.
+        '''
+        from pyramid.wsgi import wsgiapp2
+        self.config.add_route('web_deps_bundles',
+                              bundler.url_prefix + '/*subpath')
+        self.config.add_view(wsgiapp2(bundler), route_name='web_deps_bundles')
+
+    def enable_preload_headers(self):
+        '''Adds to HTML responses a "Link" header that tells browsers and
+        reverse proxies to preload the page's stylesheets and scripts.
+        '''
+        self.config.add_tween('mootiro_web.web_deps.preload_tween_factory')
+
+    def enable_memoize_stats(self, path='/_debug/memoize'):
+        '''Adds a view that shows the cache statistics of every
+        memoized function as plain text. Do not enable this in production
+        unless `path` is protected somehow.
+        '''
+        from pyramid.response import Response
+        from .memoize import stats_report
+        def memoize_stats_view(request):
+            return Response(content_type='text/plain', body=stats_report() \
+                .encode('utf-8'))
+        self.config.add_route('memoize_stats', path)
+        self.config.add_view(memoize_stats_view, route_name='memoize_stats')
+
+    def enable_translation_catalogs(self, path='/transecma.js',
+            directories=None, domain=None, variable_name='mfTranslations',
+            subsets=None, compact=True):
+        '''Serves the translations for javascript (see transecma) of the
+        locale negotiated for the request. If `path` contains "{locale}",
+        e.g. "/transecma/{locale}.js", the locale comes from the URL instead.
+        Each catalog is compiled once per process, then served with
+        an ETag and gzipped.
+
+        `subsets` maps names to lists of the template files of a page
+        (or package); if `path` contains "{subset}", e.g.
+        "/transecma/{subset}.js", it serves only the messages they use.
+        '''
+        from .transecma import (CatalogCache, catalog_view_factory,
+                                template_messages)
+        cache = CatalogCache(directories or [os.path.join(self.directory,
+            'locale')], domain or self.name, variable_name=variable_name,
+            subsets={name: template_messages(paths) for name, paths
+                     in (subsets or {}).items()}, compact=compact)
+        self.config.add_route('transecma_catalog', path)
+        self.config.add_view(catalog_view_factory(cache),
+                             route_name='transecma_catalog')
+        return cache
+
     def enable_internationalization(self, extra_translation_dirs):
         self.makedirs(self.settings.get('dir_locale', '{here}/locale'))
         self.config.add_translation_dirs(self.name + ':locale',
@@ -279,11 +331,24 @@ class PyramidStarter(object):
                 h.declare_routes(self.config)
 
     def declare_deps_from_views(self, deps, rooted):
+        '''Lets each view class declare the dependencies it uses.
+        Also collects the requirements of the views decorated with
+        web_deps.declare_deps, into deps.pages (if `deps` has it).
+        '''
         self.scan()  # in order to find all the decorated view classes
         settings = self.settings
+        pages = getattr(deps, 'pages', None)
         for h in view_handlers:
             if hasattr(h, 'declare_deps'):
                 h.declare_deps(deps, rooted, settings)
+            if pages is None:
+                continue
+            for name in dir(h):
+                spec = getattr(getattr(h, name, None), 'web_deps', None)
+                if isinstance(spec, dict):
+                    page = dict(spec)
+                    page['view'] = '{}.{}'.format(h.__name__, name)
+                    pages.append(page)
 
     def scan(self):
         self.config.scan(self.name)
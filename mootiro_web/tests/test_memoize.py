@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals  # unicode by default
+
+import os
+import unittest
+from mootiro_web.memoize import *
+
+
+class TestKeyOrder(unittest.TestCase):
+    def test_push_and_pop(self):
+        order = KeyOrder()
+        for key in 'abc':
+            order.push(key)
+        order.push('a')  # a becomes the most recently used
+        self.assertEqual(list(order), ['b', 'c', 'a'])
+        self.assertEqual(len(order), 3)
+        self.assertEqual(order.pop_oldest(), 'b')
+        order.discard('a')
+        order.discard('z')  # discarding an absent key does nothing
+        self.assertEqual(list(order), ['c'])
+        self.assertIn('c', order)
+        order.clear()
+        self.assertEqual(list(order), [])
+        self.assertRaises(KeyError, order.pop_oldest)
+
+
+class TestMemoize(unittest.TestCase):
+    def test_lru(self):
+        calls = []
+        @memoize(2)
+        def double(n):
+            calls.append(n)
+            return 2 * n
+        self.assertEqual(double(1), 2)
+        self.assertEqual(double(2), 4)
+        self.assertEqual(double(1), 2)  # hit; 2 becomes the oldest
+        self.assertEqual(double(3), 6)  # evicts 2
+        self.assertEqual(double(1), 2)
+        self.assertEqual(calls, [1, 2, 3])
+        self.assertEqual(len(double.cache), 2)
+        self.assertEqual(double(2), 4)  # computed again
+        self.assertEqual(calls, [1, 2, 3, 2])
+        self.assertEqual(double.limit, 2)
+        self.assertEqual(double.func(5), 10)
+
+    def test_no_limit(self):
+        @memoize(keymaker=repr)
+        def square(n):
+            return n * n
+        for n in range(50):
+            square(n)
+        self.assertEqual(len(square.cache), 50)
+        self.assertEqual(square.cache[repr(((3,), {}))], 9)
+
+
+class TestLockedMemoize(unittest.TestCase):
+    def run_threads(self, target, count=50):
+        import threading
+        gate = threading.Event()
+        def run():
+            gate.wait()
+            target()
+        threads = [threading.Thread(target=run) for i in range(count)]
+        for t in threads:
+            t.start()
+        gate.set()
+        for t in threads:
+            t.join()
+
+    def test_single_flight(self):
+        import time
+        calls = []
+        results = []
+        @memoize(10, lock=True)
+        def slow(n):
+            calls.append(n)
+            time.sleep(0.05)
+            return [n]
+        self.run_threads(lambda: results.append(slow(7)))
+        self.assertEqual(calls, [7])
+        self.assertEqual(len(results), 50)
+        self.assertTrue(all(r is results[0] for r in results))
+
+    def test_shared_exception(self):
+        import time
+        calls = []
+        errors = []
+        @memoize(lock=True)
+        def failing(n):
+            calls.append(n)
+            time.sleep(0.05)
+            raise ValueError(n)
+        def call():
+            try:
+                failing(1)
+            except ValueError as e:
+                errors.append(e)
+        self.run_threads(call, count=20)
+        self.assertEqual(calls, [1])
+        self.assertEqual(len(errors), 20)
+        self.assertEqual(len(failing.cache), 0)
+        self.assertRaises(ValueError, failing, 1)  # errors are not cached
+        self.assertEqual(calls, [1, 1])
+
+    def test_interrupted_leader(self):
+        import threading
+        import time
+        class Interrupt(BaseException):
+            pass
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        @memoize(lock=True)
+        def compute(n):
+            calls.append(n)
+            if len(calls) == 1:
+                started.set()
+                release.wait()
+                raise Interrupt()
+            return n * 2
+        def leader():
+            try:
+                compute(4)
+            except Interrupt:
+                pass
+        results = []
+        threads = [threading.Thread(target=leader),
+                   threading.Thread(target=lambda: results.append(compute(4)))]
+        threads[0].start()
+        started.wait()
+        threads[1].start()
+        time.sleep(0.05)  # let the second thread wait for the flight
+        release.set()
+        for t in threads:
+            t.join(2)
+        self.assertFalse(any(t.is_alive() for t in threads))
+        self.assertEqual(results, [8])
+        self.assertEqual(compute(4), 8)  # no flight was left behind
+        self.assertEqual(calls, [4, 4])
+
+    def test_stress_evictions(self):
+        import random
+        @memoize(8, lock=True)
+        def triple(n):
+            return 3 * n
+        wrong = []
+        def hammer():
+            for i in range(300):
+                n = random.randint(0, 20)
+                if triple(n) != 3 * n:
+                    wrong.append(n)
+        self.run_threads(hammer, count=30)
+        self.assertEqual(wrong, [])
+        self.assertEqual(len(triple.cache), 8)
+        self.assertEqual(sorted(triple.cache.keys()),
+                         sorted(triple.popular))
+
+
+class TestKeymakers(unittest.TestCase):
+    def test_hashable_key(self):
+        self.assertEqual(hashable_key(((1, 'a'), {})), (1, 'a'))
+        self.assertEqual(hashable_key(((1,), dict(b=2, a=1))),
+                         (1, KW_MARK, ('a', 1), ('b', 2)))
+        self.assertNotEqual(hashable_key((([1, 2],), {})),
+                            hashable_key((((1, 2),), {})))
+        key = hashable_key((({'x': [1]}, set([2])), {}))
+        self.assertEqual(hash(key), hash(hashable_key(
+            (({'x': [1]}, set([2])), {}))))
+
+    def test_identity_key(self):
+        obj = object()
+        items = [object(), object()]
+        self.assertEqual(identity_key(((obj, items, 'a'), {})),
+            (id(obj), (list, (id(items[0]), id(items[1]))), 'a'))
+        self.assertEqual(identity_key(((obj, list(items), 'a'), {})),
+                         identity_key(((obj, items, 'a'), {})))
+
+    def test_identity_key_of_short_lived_lists(self):
+        '''Strings inside lists are keyed by value, not by id(), which
+        is reused once a temporary list is collected.
+        '''
+        @memoize(keymaker=identity_key)
+        def shout(handles):
+            return handles[0] + '!'
+        words = ['jquery', 'deform', 'ui', 'maps']
+        self.assertEqual([shout([w.upper()]) for w in words],
+                         ['JQUERY!', 'DEFORM!', 'UI!', 'MAPS!'])
+        self.assertEqual(identity_key(((['a' + 'b'],), {})),
+                         ((list, ('ab',)),))
+
+    def test_default_key_types(self):
+        '''The default keymaker tells equal values of different types
+        apart.
+        '''
+        memo_repr = memoize()(repr)
+        self.assertEqual((memo_repr(1), memo_repr(True), memo_repr(1.0)),
+                         ('1', 'True', '1.0'))
+        self.assertEqual(memo_repr([1]), '[1]')
+        self.assertEqual(memo_repr([True]), '[True]')
+        self.assertEqual(memo_repr({1: 1}), '{1: 1}')
+        self.assertEqual(memo_repr({1: 1.0}), '{1: 1.0}')
+        self.assertNotEqual(pickle_key(((b'a',), {})),
+                            pickle_key((('a',), {})))
+
+    def test_kwargs_order(self):
+        calls = []
+        @memoize()
+        def f(a, b=0, c=0):
+            calls.append(a)
+            return a + b + c
+        self.assertEqual(f(1, b=2, c=3), 6)
+        self.assertEqual(f(1, c=3, b=2), 6)
+        self.assertEqual(calls, [1])
+
+
+class TestEvictionPolicies(unittest.TestCase):
+    def setUp(self):
+        import mootiro_web.memoize as module
+        self.module = module
+        self.real_now = module.now
+        self.moment = 1000.0
+        module.now = lambda: self.moment
+
+    def tearDown(self):
+        self.module.now = self.real_now
+
+    def test_ttl(self):
+        calls = []
+        @memoize(ttl=10)
+        def f(n):
+            calls.append(n)
+            return n
+        f(1)
+        self.moment += 5
+        f(2)
+        f(1)
+        self.assertEqual(calls, [1, 2])
+        self.moment += 6  # 1 has expired, 2 has not
+        f(1)
+        f(2)
+        self.assertEqual(calls, [1, 2, 1])
+        self.moment += 20  # storing 3 purges every expired value
+        f(3)
+        self.assertEqual(len(f.cache), 1)
+
+    def test_max_bytes(self):
+        @memoize(max_bytes=10, sizeof=len)
+        def text(n):
+            return 'x' * n
+        text(4)
+        text(5)
+        self.assertEqual(len(text.cache), 2)
+        text(4)  # now 5 is the least recently used
+        text(3)  # 12 bytes > 10, so 5 is discarded
+        self.assertEqual(sorted(text.cache.values()), ['xxx', 'xxxx'])
+        text(20)  # too big to be kept at all
+        self.assertEqual(len(text.cache), 0)
+
+    def test_combined(self):
+        @memoize(limit=2, ttl=10, max_bytes=100, sizeof=len, lock=True)
+        def text(n):
+            return 'x' * n
+        for n in (1, 2, 3):
+            text(n)
+        self.assertEqual(sorted(text.cache.values()), ['xx', 'xxx'])
+        self.moment += 11
+        text(4)
+        self.assertEqual(list(text.cache.values()), ['xxxx'])
+
+
+class TestStats(unittest.TestCase):
+    def test_counters(self):
+        @memoize(2, max_bytes=100, sizeof=len)
+        def text(n):
+            return 'x' * n
+        for n in (1, 2, 1, 3, 1):
+            text(n)
+        stats = text.stats
+        self.assertEqual((stats.hits, stats.misses, stats.evictions),
+                         (2, 3, 1))
+        self.assertEqual(stats.size, 2)
+        self.assertEqual(stats.bytes, 4)
+        self.assertAlmostEqual(stats.hit_ratio, 0.4)
+        self.assertTrue(stats.compute_time >= 0)
+        self.assertTrue(stats.name.endswith('text'))
+        stats.reset()
+        self.assertEqual(stats.as_dict()['hits'], 0)
+        self.assertEqual(stats.as_dict()['size'], 2)
+
+    def test_registry(self):
+        @memoize()
+        def registered_fn(n):
+            return n
+        registered_fn(1)
+        registered_fn(1)
+        self.assertIn(registered_fn, memoized)
+        self.assertIn(registered_fn.stats, all_stats())
+        line = [l for l in stats_report().splitlines()
+                if 'registered_fn' in l][0]
+        self.assertIn('50.0%', line)
+
+
+class TestFileCache(unittest.TestCase):
+    def setUp(self):
+        from tempfile import mkdtemp
+        self.directory = mkdtemp()
+
+    def tearDown(self):
+        from shutil import rmtree
+        rmtree(self.directory)
+
+    def test_mapping(self):
+        cache = FileCache(self.directory)
+        cache[(1, 'a')] = {'value': [1, 2]}
+        self.assertEqual(cache[(1, 'a')], {'value': [1, 2]})
+        self.assertIn((1, 'a'), cache)
+        self.assertEqual(len(cache), 1)
+        self.assertRaises(KeyError, lambda: cache['absent'])
+        self.assertEqual(cache.pop((1, 'a')), {'value': [1, 2]})
+        self.assertEqual(cache.pop((1, 'a'), None), None)
+        cache['b'] = 2
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_shared_between_caches(self):
+        '''Two FileCache instances on one directory stand for 2 processes.'''
+        from functools import partial
+        calls = []
+        def square(n):
+            calls.append(n)
+            return n * n
+        factory = partial(FileCache, self.directory)
+        worker1 = memoize(cache_type=factory)(square)
+        worker2 = memoize(cache_type=factory)(square)
+        self.assertEqual(worker1(3), 9)
+        self.assertEqual(worker2(3), 9)
+        self.assertEqual(calls, [3])
+        self.assertEqual(worker2.stats.hits, 1)
+
+    def test_ttl_of_values_stored_by_another_process(self):
+        import time
+        from functools import partial
+        calls = []
+        def square(n):
+            calls.append(n)
+            return n * n
+        factory = partial(FileCache, self.directory)
+        worker1 = memoize(cache_type=factory, ttl=10)(square)
+        worker2 = memoize(cache_type=factory, ttl=10)(square)
+        self.assertEqual(worker1(3), 9)
+        self.assertEqual(worker2(3), 9)
+        self.assertEqual(calls, [3])
+        past = time.time() - 2000
+        for name in os.listdir(self.directory):
+            os.utime(os.path.join(self.directory, name), (past, past))
+        self.assertEqual(worker2(3), 9)
+        self.assertEqual(calls, [3, 3])
+        self.assertEqual(worker1(3), 9)  # stored again by worker2
+        self.assertEqual(calls, [3, 3])
+
+    def test_eviction(self):
+        from functools import partial
+        @memoize(1, cache_type=partial(FileCache, self.directory))
+        def square(n):
+            return n * n
+        square(2)
+        square(3)
+        self.assertEqual(len(square.cache), 1)
+
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+# The async syntax would not even compile in Python 2, hence exec().
+ASYNC_SOURCE = '''
+calls = []
+
+async def fetch(n):
+    calls.append(n)
+    await asyncio.sleep(0.01)
+    if n < 0:
+        raise ValueError(n)
+    return [n]
+
+async def gather(fn, *args):
+    return await asyncio.gather(*[fn(a) for a in args],
+                                return_exceptions=True)
+'''
+
+
+@unittest.skipIf(asyncio is None, 'asyncio is not available.')
+class TestAsyncMemoize(unittest.TestCase):
+    def setUp(self):
+        self.ns = dict(asyncio=asyncio)
+        exec(ASYNC_SOURCE, self.ns)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_loop(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_caches_results(self):
+        fetch = memoize(2)(self.ns['fetch'])
+        first = self.run_loop(self.ns['gather'](fetch, 1, 1))
+        self.assertEqual(first, [[1], [1]])
+        self.assertIs(first[0], first[1])
+        again = self.run_loop(self.ns['gather'](fetch, 1))
+        self.assertIs(again[0], first[0])  # a result, not a coroutine
+        self.assertEqual(self.ns['calls'], [1])
+        self.assertEqual((fetch.stats.hits, fetch.stats.misses), (2, 1))
+        self.run_loop(self.ns['gather'](fetch, 2, 3))
+        self.assertEqual(len(fetch.cache), 2)  # the LRU still works
+
+    def test_failures_are_not_cached(self):
+        fetch = memoize()(self.ns['fetch'])
+        results = self.run_loop(self.ns['gather'](fetch, -1, -1))
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+        self.run_loop(self.ns['gather'](fetch, -1))
+        self.assertEqual(self.ns['calls'], [-1, -1])
+        self.assertEqual(len(fetch.cache), 0)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals  # unicode by default
+
+import unittest
+import warnings
+from mootiro_web.page_deps import *
+
+
+def declare(r):
+    r.lib('jquery', ['http://jquery'])
+    r.stylesheet('jquery', 'http://jquery.css')
+    r.lib('jquery.ui', 'http://jquery.ui', 'jquery')
+    r.lib('deform', 'http://deform.js', 'jquery')
+    r.stylesheet('deform', 'http://deform.css')
+    r.stylesheet('reset', 'http://reset.css', priority=-1)
+    r.lib('triform', 'http://triform.js', 'deform|jquery.ui')
+    r.package('triform', libs='triform', css='deform',
+              onload=lambda: '// triform')
+    return r
+
+
+class TestFastPageDeps(unittest.TestCase):
+    def setUp(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            self.old = declare(DepsRegistry())
+            self.fast = declare(FastDepsRegistry())
+
+    def pages(self):
+        return PageDeps(self.old), self.fast.page_class(self.fast)
+
+    def test_same_output(self):
+        old, fast = self.pages()
+        for p in (old, fast):
+            p.package('triform')
+            p.libs('deform')
+            p.stylesheets('deform|jquery|reset|deform')
+        # Both orders are valid; the fast one follows declaration order
+        self.assertEqual(set(fast.sorted_libs), set(old.sorted_libs))
+        self.assertEqual(fast.sorted_libs, ['http://jquery', 'http://jquery.ui',
+            'http://deform.js', 'http://triform.js'])
+        self.assertEqual(set(fast.sorted_stylesheets),
+                         set(old.sorted_stylesheets))
+        self.assertEqual(fast.sorted_stylesheets[0], 'http://reset.css')
+        old, fast = self.pages()
+        for p in (old, fast):
+            p.libs('jquery.ui|deform')
+            p.stylesheets(['deform', 'jquery'])
+            p.onload('go();')
+        self.assertEqual(fast.out_libs, old.out_libs)
+        self.assertEqual(fast.sorted_stylesheets,
+                         ['http://jquery.css', 'http://deform.css'])
+        self.assertEqual(unicode(fast), unicode(old))
+
+    def test_package(self):
+        old, fast = self.pages()
+        old.package('triform')
+        fast.package('triform')
+        self.assertEqual(set(fast.sorted_libs), set(old.sorted_libs))
+        self.assertEqual(fast.sorted_libs, ['http://jquery', 'http://jquery.ui',
+            'http://deform.js', 'http://triform.js'])
+        self.assertEqual(fast.out_onloads(), '// triform\n')
+
+    def test_late_registration(self):
+        self.fast.page_class(self.fast)
+        self.fast.stylesheet('print', 'http://print.css')
+        page = self.fast.page_class(self.fast)
+        page.stylesheets('print|reset')
+        self.assertEqual(page.sorted_stylesheets,
+                         ['http://reset.css', 'http://print.css'])
@@ -0,0 +1,432 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals  # unicode by default
+
+import os
+import unittest
+from shutil import rmtree
+from tempfile import mkdtemp
+from mootiro_web import transecma
+
+try:
+    import babel
+except ImportError:
+    babel = None
+try:
+    import pyramid
+except ImportError:
+    pyramid = None
+
+PO = '''msgid ""
+msgstr ""
+"Content-Type: text/plain; charset=UTF-8\\n"
+
+msgid "Hello"
+msgstr "{}"
+'''
+
+
+def write_mo(path, messages, byteorder='<'):
+    '''Writes a .mo file (without the optional hash table).'''
+    from struct import pack
+    messages = sorted((k.encode('utf-8'), v.encode('utf-8'))
+                      for k, v in messages.items())
+    count = len(messages)
+    ids_at = 28
+    strs_at = ids_at + 8 * count
+    offset = strs_at + 8 * count
+    ids, strs, data = [], [], []
+    for table, index in ((ids, 0), (strs, 1)):
+        for message in messages:
+            table.append(pack(byteorder + b'2I', len(message[index]), offset))
+            data.append(message[index] + b'\0')
+            offset += len(message[index]) + 1
+    with open(path, 'wb') as f:
+        f.write(pack(byteorder + b'7I', 0x950412de, 0, count, ids_at,
+                     strs_at, 0, 0))
+        f.write(b''.join(ids + strs + data))
+
+
+def fake_po2dict(test, translations=None):
+    '''Replaces transecma.po2dict, until `test` ends, with a function
+    that returns `translations` without reading the .po file (so Babel
+    is not needed). Returns the list of locales it is called for.
+    '''
+    compiled = []
+    def po2dict(stream, locale, **kw):
+        compiled.append(locale)
+        return dict(translations or {})
+    test.addCleanup(setattr, transecma, 'po2dict', transecma.po2dict)
+    transecma.po2dict = po2dict
+    return compiled
+
+
+class TestCompileDir(unittest.TestCase):
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.out_dir = os.path.join(self.dir, 'js')
+        for locale, hello in (('pt_BR', 'Olá'), ('es', 'Hola'),
+                              ('de', 'Hallo')):
+            self.write_po(locale, hello)
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def write_po(self, locale, hello):
+        directory = os.path.join(self.dir, 'locale', locale, 'LC_MESSAGES')
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, 'app.po'), 'wb') as f:
+            f.write(PO.format(hello).encode('utf-8'))
+
+    def compile(self, **kw):
+        transecma.compile_dir(os.path.join(self.dir, 'locale'), 'app',
+                              self.out_dir, variable_name='tr', **kw)
+
+    def test_incremental(self):
+        compiled = fake_po2dict(self)
+        self.compile(incremental=True)
+        self.assertEqual(compiled, ['de', 'es', 'pt_BR'])
+        self.compile(incremental=True)
+        self.assertEqual(len(compiled), 3)
+        self.write_po('es', '¡Hola')  # changes the size
+        os.remove(os.path.join(self.out_dir, 'de.js'))
+        self.compile(incremental=True)
+        self.assertEqual(compiled[3:], ['de', 'es'])
+        self.compile(incremental=True, include_lib=True)
+        self.assertEqual(len(compiled), 8)
+
+    def test_incremental_outputs(self):
+        '''Deleted subset and compressed files are written again.'''
+        compiled = fake_po2dict(self, dict(Hello='Oi'))
+        template = os.path.join(self.dir, 'a.tmpl')
+        with open(template, 'wb') as f:
+            f.write(b'${_("Hello")}')
+        kw = dict(incremental=True, subsets=dict(a=[template]),
+                  compress=['gz'])
+        self.compile(**kw)
+        self.assertEqual(len(compiled), 3)
+        for name in ('pt_BR.a.js', 'es.js.gz', 'de.a.js.gz'):
+            os.remove(os.path.join(self.out_dir, name))
+            self.compile(**kw)
+            self.assertTrue(os.path.exists(os.path.join(self.out_dir, name)))
+        self.assertEqual(compiled[3:], ['pt_BR', 'es', 'de'])
+        self.compile(**kw)
+        self.assertEqual(len(compiled), 6)
+
+    @unittest.skipUnless(babel, 'Babel is not installed')
+    def test_jobs(self):
+        self.compile(jobs=2)
+        with open(os.path.join(self.out_dir, 'pt_BR.js'), 'rb') as f:
+            self.assertIn('"Hello": "Ol\\u00e1"',
+                          f.read().decode('utf-8'))
+
+
+class TestCatalogCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.path = os.path.join(self.dir, 'pt_BR', 'LC_MESSAGES', 'app.po')
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'wb') as f:
+            f.write(b'one')
+        self.cache = transecma.CatalogCache([self.dir], 'app',
+            subsets=dict(page={'one', 'two'}))
+        self.compiled = []
+        def load(path, locale):
+            self.compiled.append(locale)
+            with open(path, 'rb') as f:
+                return dict(one=f.read().decode('utf-8'), three='3')
+        self.cache.load = load
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def test_get(self):
+        import gzip
+        import json
+        from io import BytesIO
+        self.assertIsNone(self.cache.get('es'))
+        first = self.cache.get('pt_BR')
+        self.assertIs(self.cache.get('pt_BR'), first)
+        self.assertEqual(self.compiled, ['pt_BR'])
+        self.assertEqual(json.loads(first.body.decode('utf-8')),
+                         dict(one='one', three='3'))
+        self.assertEqual(gzip.GzipFile(fileobj=BytesIO(first.gzipped))
+                         .read(), first.body)
+        with open(self.path, 'wb') as f:
+            f.write(b'uno')
+        second = self.cache.get('pt_BR')
+        self.assertIn(b'"uno"', second.body)
+        self.assertNotEqual(second.etag, first.etag)
+
+    def test_subset(self):
+        self.assertEqual(self.cache.get('pt_BR', 'page').body,
+                         b'{\n "one": "one"\n}')
+        self.assertIn(b'"three"', self.cache.get('pt_BR').body)
+        self.assertRaises(KeyError, self.cache.get, 'pt_BR', 'nope')
+
+    def test_bad_locale(self):
+        # A catalog outside the directories must not be reachable
+        other = os.path.join(self.dir, 'other', 'LC_MESSAGES', 'app.po')
+        os.makedirs(os.path.dirname(other))
+        with open(other, 'wb') as f:
+            f.write(b'secret')
+        self.cache.directories = [os.path.join(self.dir, 'pt_BR')]
+        for locale in ('../other', '..', 'pt/../../other', '', 'pt\0'):
+            self.assertIsNone(self.cache.find(locale))
+            self.assertIsNone(self.cache.get(locale))
+        self.assertEqual(self.compiled, [])
+        for locale in ('pt', 'pt_BR', 'sr_Latn_RS', 'ca_ES@valencia'):
+            self.assertTrue(transecma.LOCALE.match(locale))
+
+    @unittest.skipUnless(pyramid, 'Pyramid is not installed')
+    def test_view(self):
+        import gzip
+        from io import BytesIO
+        view = transecma.catalog_view_factory(self.cache)
+        class Request(object):
+            def __init__(self, matchdict=None, accept_encoding=None,
+                         if_none_match=()):
+                self.matchdict = matchdict
+                self.headers = {}
+                if accept_encoding:
+                    self.headers['Accept-Encoding'] = accept_encoding
+                self.if_none_match = set(if_none_match)
+                self.locale_name = 'pt_BR'  # as negotiated by Pyramid
+        compiled = self.cache.get('pt_BR')
+        response = view(Request(dict(locale='pt_BR')))
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(response.body, compiled.body)
+        self.assertEqual(response.headers['ETag'],  # strong, not W/"..."
+                         '"{}"'.format(compiled.etag))
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+        self.assertIsNone(response.content_encoding)
+        # gzip, with its own ETag
+        response = view(Request(dict(locale='pt_BR'), 'gzip, deflate'))
+        self.assertEqual(response.content_encoding, 'gzip')
+        self.assertEqual(response.etag, compiled.etag + '-gzip')
+        self.assertEqual(gzip.GzipFile(fileobj=BytesIO(response.body))
+                         .read(), compiled.body)
+        self.assertEqual(view(Request(dict(locale='pt_BR'), 'gzip;q=0'))
+                         .etag, compiled.etag)
+        # 304 when the ETag matches
+        response = view(Request(dict(locale='pt_BR'),
+                                if_none_match=[compiled.etag]))
+        self.assertEqual(response.status_int, 304)
+        self.assertEqual(response.headers['ETag'],
+                         '"{}"'.format(compiled.etag))
+        self.assertEqual(view(Request(dict(locale='pt_BR'), 'gzip',
+            if_none_match=[compiled.etag])).status_int, 200)
+        # The negotiated locale, which varies with the request
+        response = view(Request())
+        self.assertEqual(response.body, compiled.body)
+        self.assertEqual(response.headers['Vary'],
+                         'Accept-Encoding, Accept-Language, Cookie')
+        # Subsets
+        response = view(Request(dict(locale='pt_BR', subset='page')))
+        self.assertEqual(response.body, b'{\n "one": "one"\n}')
+        # 404 for unknown locales and subsets
+        for matchdict in (dict(locale='es'), dict(locale='../pt_BR'),
+                          dict(locale='pt_BR', subset='nope')):
+            self.assertEqual(view(Request(matchdict)).status_int, 404)
+
+    @unittest.skipUnless(pyramid, 'Pyramid is not installed')
+    def test_view_compile_errors(self):
+        '''A KeyError raised while compiling is not hidden as a 404.'''
+        def load(path, locale):
+            raise KeyError('broken')
+        self.cache.load = load
+        view = transecma.catalog_view_factory(self.cache)
+        class Request(object):
+            matchdict = dict(locale='pt_BR')
+            headers = {}
+            if_none_match = ()
+        self.assertRaises(KeyError, view, Request())
+
+    def test_accepts_gzip(self):
+        accepts = transecma.accepts_gzip
+        self.assertTrue(accepts('gzip, deflate'))
+        self.assertTrue(accepts('deflate;q=1, GZIP;q=0.5'))
+        self.assertTrue(accepts('*'))
+        self.assertFalse(accepts(None))
+        self.assertFalse(accepts('gzip;q=0, *'))
+        self.assertFalse(accepts('br'))
+
+
+class TestMo2Dict(unittest.TestCase):
+    MESSAGES = {
+        '': 'Content-Type: text/plain; charset=UTF-8\n',
+        'Hello': 'Olá',
+        'Untranslated': '',
+        'menu\x04Open': 'Abrir',
+        'One item\x00[0] items': 'Um item\x00[0] itens',
+    }
+
+    def setUp(self):
+        self.dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def test_mo2dict(self):
+        import gettext
+        for byteorder in '<>':
+            path = os.path.join(self.dir, 'app.mo')
+            write_mo(path, self.MESSAGES, byteorder=byteorder)
+            d = transecma.mo2dict(path)
+            self.assertEqual(d['Hello'], 'Olá')
+            self.assertEqual(d['Open'], 'Abrir')
+            self.assertEqual(d['One item'], 'Um item')
+            self.assertEqual(d['[0] items'], '[0] itens')
+            self.assertNotIn('Untranslated', d)
+        # The separator used to decode all the messages at once
+        write_mo(path, dict(self.MESSAGES, **{'Odd\x01': 'Estranho'}))
+        self.assertEqual(transecma.mo2dict(path)['Odd\x01'], 'Estranho')
+        with open(path, 'rb') as f:  # the standard library agrees
+            translations = gettext.GNUTranslations(f)
+        gettext_ = getattr(translations, 'ugettext', translations.gettext)
+        self.assertEqual(gettext_('Hello'), 'Olá')
+
+    def test_not_mo(self):
+        path = os.path.join(self.dir, 'empty.mo')
+        open(path, 'wb').close()
+        self.assertRaises(ValueError, transecma.mo2dict, path)
+
+    def test_catalog_cache_prefers_mo(self):
+        directory = os.path.join(self.dir, 'de', 'LC_MESSAGES')
+        os.makedirs(directory)
+        write_mo(os.path.join(directory, 'app.mo'), self.MESSAGES)
+        po_path = os.path.join(directory, 'app.po')
+        open(po_path, 'wb').close()
+        compiled = os.path.getmtime(os.path.join(directory, 'app.mo'))
+        os.utime(po_path, (compiled - 10, compiled - 10))
+        cache = transecma.CatalogCache(self.dir, 'app', variable_name='tr')
+        self.assertTrue(cache.find('de').endswith('app.mo'))
+        self.assertIn('"Hello": "Ol\\u00e1"',
+                      cache.get('de').body.decode('utf-8'))
+        # A .po edited after compiling is newer than its .mo
+        os.utime(po_path, (compiled + 10, compiled + 10))
+        self.assertEqual(cache.find('de'), po_path)
+        # .mo files leave out fuzzy translations
+        os.utime(po_path, (compiled - 10, compiled - 10))
+        cache.use_fuzzy = True
+        self.assertEqual(cache.find('de'), po_path)
+        os.remove(po_path)
+        self.assertTrue(cache.find('de').endswith('app.mo'))
+
+
+class TestSubsets(unittest.TestCase):
+    def setUp(self):
+        self.dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def write(self, name, content):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(content.encode('utf-8'))
+        return path
+
+    def test_template_messages(self):
+        paths = [self.write('a.tmpl', '<p>${_("Hello")}</p>\n'
+                                      "<p>${tr('Bye')} ${_('Hello')}</p>"),
+                 self.write('b.js', 'alert(gettext("Olá"));')]
+        self.assertEqual(transecma.template_messages(paths),
+                         {'Hello', 'Bye', 'Olá'})
+        self.assertEqual(transecma.select(dict(Hello='Oi', Other='Outro'),
+            transecma.template_messages(paths)), dict(Hello='Oi'))
+
+    def test_compile_dir(self):
+        directory = os.path.join(self.dir, 'locale', 'pt_BR', 'LC_MESSAGES')
+        os.makedirs(directory)
+        open(os.path.join(directory, 'app.po'), 'wb').close()
+        template = self.write('a.tmpl', '${_("Hello")}')
+        fake_po2dict(self, dict(Hello='Oi', Other='Outro'))
+        transecma.compile_dir(os.path.join(self.dir, 'locale'), 'app',
+            self.dir, variable_name='tr', subsets=dict(a=[template]))
+        with open(os.path.join(self.dir, 'pt_BR.a.js'), 'rb') as f:
+            self.assertEqual(f.read(), b'tr = {\n "Hello": "Oi"\n};\n')
+        with open(os.path.join(self.dir, 'pt_BR.js'), 'rb') as f:
+            self.assertIn(b'"Other"', f.read())
+
+
+class TestExtractor(unittest.TestCase):
+    def extract(self, text, keywords=('_', 'tr')):
+        from io import BytesIO
+        return [(lineno, funcname, message) for lineno, funcname, message, c
+                in transecma.extract_jquery_templates(
+                    BytesIO(text.encode('utf-8')), keywords, [], {})]
+
+    def test_extract(self):
+        self.assertEqual(self.extract(
+            '<p>${_("Hello")} ${tr( \'Bye\' )}</p>\n'
+            '${str("not this")} ${_(name)} ${_("")}\n'
+            '${_("Say \\"hi\\"")} ${_(\'It\\\'s\')} ${_("a\\\\b\\u00e1")}\n'
+            '${_("One item", "[0] items", n).interpol(n)}\n'
+            '${_("With mapping", values)}'), [
+                (1, '_', 'Hello'),
+                (1, 'tr', 'Bye'),
+                (3, '_', 'Say "hi"'),
+                (3, '_', "It's"),
+                (3, '_', 'a\\bá'),
+                (4, '_', ('One item', '[0] items')),
+                (5, '_', 'With mapping'),
+            ])
+
+    @unittest.skipUnless(babel, 'Babel is not installed')
+    def test_babel_plurals(self):
+        '''Through Babel, with its default keywords, plural calls of "_"
+        keep both messages, and one-argument calls still work.
+        '''
+        from io import BytesIO
+        from babel.messages.extract import extract
+        source = ('${_("Hello")} ${gettext("Bye")}\n'
+                  '${_("One item", "[0] items", n).interpol(n)}\n'
+                  '${ngettext("One page", "[0] pages", n)}\n')
+        self.assertEqual([(lineno, message) for lineno, message, c, ctx in
+            extract(transecma.extract_jquery_templates,
+                    BytesIO(source.encode('utf-8')))], [
+                (1, 'Hello'),
+                (1, 'Bye'),
+                (2, ('One item', '[0] items')),
+                (3, ('One page', '[0] pages')),
+            ])
+
+    def test_keywords(self):
+        self.assertEqual(self.extract('gettext("a") + _("b") + get("c")',
+                                      keywords=['gettext', 'get']),
+                         [(1, 'gettext', 'a'), (1, 'get', 'c')])
+
+
+class TestJson(unittest.TestCase):
+    def test_make_json(self):
+        import json
+        self.assertEqual(transecma.make_json({'a/b': 'Olá'}, 'x',
+            compact=True), 'x = {"a\\/b":"Ol\\u00e1"};\n')
+        self.assertEqual(transecma.make_json({}, compact=True), '{}')
+        self.assertEqual(transecma.make_json([1, '</script>'], compact=True),
+                         '[1,"<\\/script>"]')
+        big = {'message {}'.format(i): 'mensagem/{}'.format(i)
+               for i in range(2500)}
+        chunks = list(transecma.iter_json(big, compact=True))
+        self.assertEqual(len(chunks), 4)
+        self.assertNotIn(' ', ''.join(chunks).replace('message ', ''))
+        self.assertEqual(json.loads(''.join(chunks)), big)
+
+    def test_compile_dir(self):
+        import gzip
+        directory = mkdtemp()
+        self.addCleanup(rmtree, directory)
+        po_dir = os.path.join(directory, 'locale', 'pt_BR', 'LC_MESSAGES')
+        os.makedirs(po_dir)
+        open(os.path.join(po_dir, 'app.po'), 'wb').close()
+        fake_po2dict(self, dict(Hello='Oi'))
+        transecma.compile_dir(os.path.join(directory, 'locale'), 'app',
+            directory, variable_name='tr', compact=True, compress=['gz'])
+        path = os.path.join(directory, 'pt_BR.js')
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'tr = {"Hello":"Oi"};\n')
+        with gzip.open(path + '.gz', 'rb') as f:
+            self.assertEqual(f.read(), b'tr = {"Hello":"Oi"};\n')
+        self.assertRaises(ValueError, transecma.compress_file, path, 'zip')
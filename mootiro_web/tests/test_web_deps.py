@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals  # unicode by default
 
+import os
 import unittest
 from mootiro_web.web_deps import *
 
@@ -22,9 +23,50 @@ class TestDepsRegistry(unittest.TestCase):
         self.assertEqual(reg.summon('b'), [b])
         self.assertEqual(reg.summon('m'), [a, m])
         self.assertEqual(reg.summon('n'), [a, m, b, n])
-        self.assertEqual(reg.summon('m, b'), [b, a, m])
-        self.assertEqual(reg.summon('montão'), [a, b, m, n, all])
+        # Items that do not depend on each other keep the declaration order
+        self.assertEqual(reg.summon('m, b'), [a, m, b])
+        self.assertEqual(reg.summon('b, m'), [a, m, b])
+        self.assertEqual(reg.summon('montão'), [a, m, b, n, all])
         self.assertEqual(reg.summon('montão,a,b,m,n'), [a, m, b, n, all])
+        self.assertEqual(reg.by_rank, [a, m, b, n, all])
+        self.assertEqual(reg.closures[n], 0b1111)
+
+    def test_check(self):
+        reg = DepsRegistry()
+        reg.admit(Dependency('a', deps='b'), Dependency('b', deps='c, a'),
+                  Dependency('c', deps='c, typo'), Dependency('d', deps='a'))
+        with self.assertRaises(DepsError) as context:
+            reg.close()
+        self.assertEqual(context.exception.problems, [
+            '"c" depends on unknown "typo".',
+            'Circular dependency: c -> c.',
+            'Circular dependency: a -> b -> a.',
+        ])
+        self.assertIsInstance(context.exception, RuntimeError)
+
+    def test_deep_graph(self):
+        reg = DepsRegistry()
+        reg.admit(*[Dependency(unicode(i), deps=unicode(i - 1) if i else '')
+                    for i in range(5000)])
+        reg.close()  # no recursion limit
+        self.assertEqual(len(reg.summon('4999')), 5000)
+
+
+class TestWebDepsCheck(unittest.TestCase):
+    def test_all_problems_together(self):
+        deps = WebDeps()
+        deps.lib('jquery', url='/jquery.js', deps='jquery.ui')
+        deps.lib('jquery.ui', url='/jquery.ui.js', deps='jquery')
+        deps.css('deform', url='/deform.css', deps='nothing')
+        deps.package('deform', libs='deform', css='deform', deps='other')
+        with self.assertRaises(DepsError) as context:
+            deps.close()
+        self.assertEqual(context.exception.problems, [
+            'lib Circular dependency: jquery -> jquery.ui -> jquery.',
+            'css "deform" depends on unknown "nothing".',
+            'package "deform" depends on unknown "other".',
+            'package "deform" wants unknown libs "deform".',
+        ])
 
 
 class TestPageDeps(unittest.TestCase):
@@ -116,3 +158,451 @@ alert("JQuery UI spam!");
 alert("JQuery UI spam!");
 alert("Deform spam!");
 </script>\n'''.lstrip())
+
+
+class TempFilesMixin(object):
+    '''For tests that need files in a temporary directory, self.dir,
+    which is removed after each test.
+    '''
+    def setUp(self):
+        from shutil import rmtree
+        from tempfile import mkdtemp
+        self.dir = mkdtemp()
+        self.addCleanup(rmtree, self.dir)
+
+    def write(self, name, content):
+        '''Writes a file in self.dir and returns its path.'''
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+
+class TestBundler(TempFilesMixin, unittest.TestCase):
+    def setUp(self):
+        super(TestBundler, self).setUp()
+        write = self.write
+        self.bundler = Bundler(os.path.join(self.dir, 'bundles'))
+        deps = WebDeps(bundler=self.bundler)
+        deps.lib('jquery', url='/jquery.js', path=write('jquery.js', 'var $;'))
+        deps.lib('ui', url='/ui.js', path=write('ui.js', '$.ui = 1;'),
+                 deps='jquery')
+        deps.lib('maps', url='http://cdn/maps.js', deps='ui')
+        deps.lib('app', url='/app.js', path=write('app.js', 'app();'),
+                 deps='ui')
+        deps.css('base', url='/base.css', path=write('base.css', 'a {}'))
+        deps.css('site', url='/site.css', path=write('site.css', 'p {}'),
+                 deps='base')
+        self.deps = deps
+        self.PageDeps = deps.close()
+
+    def serve(self, url, **environ):
+        environ['PATH_INFO'] = url
+        response = {}
+        def start_response(status, headers):
+            response['status'] = status
+            response['headers'] = dict(headers)
+        body = b''.join(self.bundler(environ, start_response))
+        return response['status'], response['headers'], body
+
+    def test_bundles(self):
+        deps = self.PageDeps()
+        deps.lib('app')
+        deps.css('site')
+        self.assertEqual(len(deps.lib.urls), 1)
+        status, headers, body = self.serve(deps.lib.urls[0])
+        self.assertEqual(status, b'200 OK')
+        self.assertEqual(body, b'var $;\n;\n$.ui = 1;\n;\napp();')
+        self.assertIn(b'max-age', headers[b'Cache-Control'])
+        status, headers, body = self.serve(deps.css.urls[0])
+        self.assertEqual(body, b'a {}\np {}')
+        self.assertEqual(deps.css.tags, '<link rel="stylesheet" '
+            'type="text/css" href="{}" />'.format(deps.css.urls[0]))
+        status, headers, body = self.serve(deps.css.urls[0],
+            HTTP_IF_NONE_MATCH=headers[b'ETag'])
+        self.assertEqual((status, body), (b'304 Not Modified', b''))
+
+    def test_external_resources_split_bundles(self):
+        deps = self.PageDeps()
+        deps.lib('maps, app')
+        urls = deps.lib.urls
+        self.assertEqual(len(urls), 3)
+        self.assertTrue(urls[0].startswith('/bundles/'))
+        self.assertEqual(urls[1], 'http://cdn/maps.js')
+        self.assertEqual(urls[2], '/app.js')  # a single file is not bundled
+
+    def test_build_bundles_and_404(self):
+        self.deps.build_bundles(dict(lib='ui', css='site'))
+        self.assertEqual(len(os.listdir(self.bundler.directory)), 2)
+        self.assertEqual(self.serve('/bundles/../jquery.js')[0],
+                         b'404 Not Found')
+
+
+class TestFingerprinter(TempFilesMixin, unittest.TestCase):
+    def setUp(self):
+        super(TestFingerprinter, self).setUp()
+        self.manifest = os.path.join(self.dir, 'manifest.json')
+        self.paths = {}
+        for name, content in (('a.js', 'a();'), ('b.css', 'b {}')):
+            self.paths[name] = self.write(name, content)
+        self.hashed = []
+        from mootiro_web import web_deps
+        real_hash_file = web_deps.hash_file
+        def hash_file(path):
+            self.hashed.append(path)
+            return real_hash_file(path)
+        web_deps.hash_file = hash_file
+        self.addCleanup(setattr, web_deps, 'hash_file', real_hash_file)
+
+    def make_page(self, **kw):
+        fingerprinter = Fingerprinter(self.manifest, **kw)
+        deps = WebDeps(url_provider=fingerprinter)
+        deps.lib('a', url='/static/a.js', path=self.paths['a.js'])
+        deps.lib('cdn', url='http://cdn/c.js')
+        deps.css('b', url='/static/b.css?x=1', path=self.paths['b.css'])
+        page = deps.close()()
+        page.lib('a, cdn')
+        page.css('b')
+        return page
+
+    def test_query(self):
+        from hashlib import sha1
+        page = self.make_page()
+        self.assertEqual(page.lib.urls, ['/static/a.js?v={}'.format(
+            sha1(b'a();').hexdigest()[:12]), 'http://cdn/c.js'])
+        self.assertEqual(page.css.urls, ['/static/b.css?x=1&v={}'.format(
+            sha1(b'b {}').hexdigest()[:12])])
+        self.assertEqual(len(self.hashed), 2)
+        # Another process reuses the manifest instead of hashing again
+        self.assertEqual(self.make_page().lib.urls, page.lib.urls)
+        self.assertEqual(len(self.hashed), 2)
+
+    def test_file_name(self):
+        page = self.make_page(query=None, length=6)
+        self.assertRegexpMatches(page.lib.urls[0], r'^/static/a\.\w{6}\.js$')
+
+
+class TestRequirementSet(unittest.TestCase):
+    def test_order_insensitive_cache(self):
+        deps = WebDeps()
+        deps.lib('jquery', url='/jquery.js')
+        deps.lib('ui', url='/ui.js', deps='jquery')
+        deps.lib('forms', url='/forms.js', deps='jquery')
+        PageDeps = deps.close()
+        reg = deps.lib
+        self.assertEqual(reg.requirement('ui, forms'),
+                         reg.requirement('forms, jquery, ui'))
+        self.assertEqual(reg.requirement(reg.requirement('ui')),
+                         reg.requirement([reg.items['ui']]))
+        page1 = PageDeps()
+        page1.lib('ui')
+        page1.lib('forms')
+        page2 = PageDeps()
+        page2.lib('forms, jquery')
+        page2.lib('ui')
+        self.assertEqual(page1.lib.requirement, page2.lib.requirement)
+        hits = WebDepsRegistry._tags.stats.hits
+        self.assertEqual(page1.lib.tags, page2.lib.tags)
+        self.assertEqual(WebDepsRegistry._tags.stats.hits, hits + 1)
+        self.assertEqual(page2.lib.urls, ['/jquery.js', '/ui.js', '/forms.js'])
+
+
+class TestPreload(unittest.TestCase):
+    def setUp(self):
+        deps = WebDeps()
+        deps.lib('jquery', url='/jquery.js')
+        deps.css('site', url='/site.css')
+        self.page = deps.close()()
+        self.page.lib('jquery')
+        self.page.css('site')
+
+    def test_link_header(self):
+        self.assertEqual(self.page.link_header,
+            '</site.css>; rel=preload; as=style, '
+            '</jquery.js>; rel=preload; as=script')
+        self.assertEqual(self.page.preload_tags,
+            '<link rel="preload" href="/site.css" as="style" />\n'
+            '<link rel="preload" href="/jquery.js" as="script" />')
+
+    def test_modules(self):
+        deps = WebDeps()
+        deps.lib('jquery', url='/jquery.js')
+        deps.lib('app', url='/app.mjs', load='module')
+        page = deps.close()()
+        page.lib('jquery, app')
+        self.assertEqual(page.link_header,
+            '</jquery.js>; rel=preload; as=script, '
+            '</app.mjs>; rel=modulepreload; as=script')
+        self.assertIn('<link rel="modulepreload" href="/app.mjs" '
+                      'as="script" />', page.preload_tags)
+
+    def test_tween(self):
+        class Headers(list):
+            def add(self, key, value):
+                self.append((key, value))
+        class Response(object):
+            def __init__(self, content_type):
+                self.content_type = content_type
+                self.headers = Headers()
+        class Registry(object):
+            settings = {'web_deps.request_attr': 'deps'}
+        class Request(object):
+            deps = self.page
+        html = preload_tween_factory(lambda r: Response('text/html'),
+                                     Registry())
+        self.assertEqual(html(Request()).headers,
+                         [(b'Link', self.page.link_header.encode('utf-8'))])
+        json = preload_tween_factory(
+            lambda r: Response('application/json'), Registry())
+        self.assertEqual(json(Request()).headers, [])
+        # Apps using mootiro_web.page_deps have its pages in the attribute
+        import warnings
+        from mootiro_web.page_deps import FastDepsRegistry
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            fast = FastDepsRegistry()
+        fast.lib('jquery', 'http://jquery')
+        Request.deps = fast.page_class(fast)
+        Request.deps.libs('jquery')
+        self.assertEqual(html(Request()).headers, [])
+
+
+class TestLoadModes(unittest.TestCase):
+    def setUp(self):
+        deps = WebDeps()
+        deps.lib('jquery', url='/jquery.js')
+        deps.lib('ui', url='/ui.js', deps='jquery', load='defer')
+        deps.lib('deform', url='/deform.js', deps='ui')  # becomes deferred
+        deps.lib('stats', url='/stats.js', load='async')
+        deps.lib('widget', url='/widget.js', deps='jquery', load='async')
+        deps.lib('app', url='/app.js', load='module')
+        self.deps = deps
+        self.PageDeps = deps.close()
+
+    def test_effective_loads(self):
+        loads = dict((d.handle, load)
+                     for d, load in self.deps.lib.loads.items())
+        self.assertEqual(loads, {'jquery': None, 'ui': 'defer',
+            'deform': 'defer', 'stats': 'async', 'widget': 'defer',
+            'app': 'module'})
+
+    def test_tags(self):
+        page = self.PageDeps()
+        page.lib('deform, stats, app')
+        self.assertEqual(page.lib.tags.splitlines(), [
+            '<script type="text/javascript" src="/jquery.js"></script>',
+            '<script type="text/javascript" src="/ui.js" defer="defer">'
+            '</script>',
+            '<script type="text/javascript" src="/deform.js" '
+            'defer="defer"></script>',
+            '<script type="text/javascript" src="/stats.js" async="async">'
+            '</script>',
+            '<script type="module" src="/app.js"></script>',
+        ])
+        page.script('go();')
+        self.assertTrue(page.lib.deferred)
+        self.assertIn("addEventListener('DOMContentLoaded'",
+                      page.bottom_output)
+
+    def test_script_tags(self):
+        '''Templates that output page.script.tags themselves (as in
+        master_global.genshi) must wait for deferred libraries, too.
+        '''
+        page = self.PageDeps()
+        page.lib('deform')
+        page.script('go();')
+        self.assertEqual(page.script.tags, '<script type="text/javascript">\n'
+            "document.addEventListener('DOMContentLoaded', function() {\n"
+            'go();\n});\n</script>\n')
+        self.assertEqual(page.script.output(deferred=False),
+            '<script type="text/javascript">\ngo();\n</script>\n')
+
+    def test_not_deferred(self):
+        page = self.PageDeps()
+        page.lib('jquery, stats')
+        page.script('go();')
+        self.assertFalse(page.lib.deferred)
+        self.assertNotIn('DOMContentLoaded', page.bottom_output)
+        self.assertNotIn('DOMContentLoaded', page.script.tags)
+
+    def test_unknown_load(self):
+        deps = WebDeps()
+        deps.lib('x', url='/x.js', load='lazy')
+        deps.css('y', url='/y.css', load='defer')
+        with self.assertRaises(DepsError) as context:
+            deps.close()
+        self.assertEqual(context.exception.problems, [
+            'lib "x" has an unknown load mode "lazy".',
+            'css "y" has an unknown load mode "defer".'])
+
+
+class TestInline(TempFilesMixin, unittest.TestCase):
+    def setUp(self):
+        super(TestInline, self).setUp()
+        write = self.write
+        deps = WebDeps(inline_below=100)
+        deps.lib('big', url='/big.js', path=write('big.js', 'x();' * 50))
+        deps.lib('tiny', url='/tiny.js', deps='big',
+                 path=write('tiny.js', 'document.write("</SCRIPT>");'))
+        deps.lib('later', url='/later.js', load='defer',
+                 path=write('later.js', 'y();'))
+        deps.css('tiny', url='/tiny.css', path=write('tiny.css', 'a {}'))
+        self.page = deps.close()()
+
+    def test_inline(self):
+        self.page.lib('tiny, later')
+        self.page.css('tiny')
+        self.assertEqual(self.page.lib.tags.splitlines(), [
+            '<script type="text/javascript" src="/big.js"></script>',
+            '<script type="text/javascript">',
+            'document.write("<\/SCRIPT>");',
+            '</script>',
+            '<script type="text/javascript" src="/later.js" defer="defer">'
+            '</script>',
+        ])
+        self.assertEqual(self.page.lib.urls, ['/big.js', '/later.js'])
+        self.assertEqual(self.page.top_output,
+                         '<style type="text/css">\na {}\n</style>')
+
+
+class TestExport(TempFilesMixin, unittest.TestCase):
+    def setUp(self):
+        super(TestExport, self).setUp()
+        write = lambda name, size: self.write(name, 'x' * size)
+        self.deps = deps = WebDeps(report=True)
+        deps.lib('jquery', url='/jquery.js', path=write('jquery.js', 1000))
+        deps.lib('ui', url='/ui.js', deps='jquery', path=write('ui.js', 300))
+        deps.css('ui', url='/ui.css', path=write('ui.css', 50))
+        deps.package('ui', libs='ui', css='ui')
+        self.factory = deps.close()
+
+    def test_graph(self):
+        import json
+        graph = json.loads(self.deps.to_json())
+        self.assertEqual([(i['handle'], i['deps']) for i in graph['lib']],
+                         [('jquery', []), ('ui', ['jquery'])])
+        self.assertEqual(graph['lib'][1]['url'], '/ui.js')
+        self.assertEqual(graph['package'][0]['libs'], 'ui')
+        dot = self.deps.to_dot()
+        self.assertTrue(dot.startswith('digraph web_deps {'))
+        self.assertIn('  "lib:ui" -> "lib:jquery";', dot)
+        self.assertIn('  "package:ui" -> "lib:ui";', dot)
+        self.assertIn('  "package:ui" -> "css:ui";', dot)
+
+    def test_report(self):
+        for i in range(3):
+            page = self.factory()
+            page.package('ui')
+            page.bottom_output
+        page = self.factory()
+        page.lib('jquery')
+        page.record()
+        rows = self.deps.report.rows()
+        self.assertEqual([(r['libs'], r['css'], r['requests'], r['bytes'],
+                           r['total']) for r in rows],
+            [(['jquery', 'ui'], ['ui'], 3, 1350, 4050),
+             (['jquery'], [], 1, 1000, 1000)])
+        self.assertIn('libs: jquery, ui | css: ui', self.deps.report.text())
+
+    def test_report_from_template(self):
+        '''As in master_global.genshi, which never renders bottom_output,
+        and requires more after the <head> is output.
+        '''
+        page = self.factory()
+        page.lib('jquery')
+        page.top_output
+        page.lib.tags
+        page.package('ui')
+        page.script.tags
+        page.script.tags
+        self.assertEqual(self.deps.report.counts,
+            {(page.lib.requirement, page.css.requirement): 1})
+
+
+class TestEarlyFlush(unittest.TestCase):
+    def setUp(self):
+        self.deps = deps = WebDeps()
+        deps.lib('jquery', url='/jquery.js')
+        deps.css('base', url='/base.css')
+        deps.css('form', url='/form.css', deps='base')
+        deps.package('form', libs='jquery', css='form')
+
+    def test_late_css(self):
+        page = self.deps.close()()
+        page.css('base')
+        self.assertEqual(page.top_output,
+            '<link rel="stylesheet" type="text/css" href="/base.css" />')
+        page.css('form')  # required by the body, after the head was sent
+        self.assertEqual(page.bottom_output.splitlines()[0],
+            '<link rel="stylesheet" type="text/css" href="/form.css" />')
+        page = self.deps.close()()
+        page.css('form')
+        self.assertNotIn('stylesheet', page.bottom_output)
+
+    def test_declare_deps(self):
+        class Request(object):
+            pass
+        class View(object):
+            def __init__(self, request):
+                self.request = request
+            @declare_deps(package='form')
+            def edit(self):
+                '''Edits.'''
+                return self.request.page_deps.css.urls
+        self.assertEqual(View.edit.web_deps['package'], 'form')
+        self.assertEqual(View.edit.__doc__, 'Edits.')
+        self.assertEqual(View.edit.__name__, 'edit')
+        self.deps.pages.append(dict(View.edit.web_deps, view='View.edit'))
+        request = Request()
+        request.page_deps = self.deps.close()()
+        self.assertEqual(View(request).edit(), ['/base.css', '/form.css'])
+        self.assertEqual(request.page_deps.lib.urls, ['/jquery.js'])
+
+    def test_unknown_declaration(self):
+        self.deps.pages.append(dict(css='nope', view='View.edit'))
+        with self.assertRaises(DepsError) as cm:
+            self.deps.close()
+        self.assertEqual(cm.exception.problems,
+                         ['View.edit declares unknown css "nope".'])
+
+
+class TestScriptComponent(unittest.TestCase):
+    def test_dedup(self):
+        script = ScriptComponent()
+        for s in ('a();', 'b();', 'a();', 'c();', 'b();'):
+            script(s)
+        self.assertEqual(list(script), ['a();', 'b();', 'c();'])
+        script.append('a();')
+        script.extend(['d();', 'b();'])
+        self.assertEqual(list(script), ['a();', 'b();', 'c();', 'd();'])
+        script.remove('a();')
+        self.assertNotIn('a();', script)
+        script('a();')
+        self.assertEqual(list(script), ['b();', 'c();', 'd();', 'a();'])
+        self.assertEqual((len(script), script[0]), (4, 'b();'))
+        self.assertFalse(ScriptComponent())
+
+    def test_minify_and_wrap(self):
+        script = ScriptComponent(minify=True, wrap='iife')
+        script('\n  var x = 1;   \n\n  f(x);\n')
+        self.assertEqual(script.output(), '<script type="text/javascript">\n'
+            '(function() {\nvar x = 1;\nf(x);\n})();\n</script>\n')
+        self.assertEqual(script.output(tag=False, deferred=True),
+            "document.addEventListener('DOMContentLoaded', function() {\n"
+            "(function() {\nvar x = 1;\nf(x);\n})();\n});\n")
+
+    def test_minified_once(self):
+        minify_script.cache.clear()
+        minify_script.stats.reset()
+        deps = WebDeps(minify_scripts=True, wrap_scripts='jquery')
+        deps.lib('jquery', url='/jquery.js')
+        factory = deps.close()
+        for i in range(3):
+            page = factory()
+            page.light_accordion()
+            self.assertTrue(page.script.tags.startswith(
+                '<script type="text/javascript">\n$(function() {\n'
+                'function processAccordion(first) {\n'
+                "var toHide = $('.accordion > div').not('.show');\n"))
+        self.assertEqual(minify_script.stats.misses, 1)
+        self.assertEqual(minify_script.stats.hits, 2)
@@ -17,11 +17,19 @@ These .po files are edited by translators in special utilities such as poedit.
 This file also contains po2json, a command that converts .PO
 translation files into javascript JSON files, so the translation may happen
 on the client, in a browser, through javascript code.
+Use its --compact option to leave out the whitespace, and --compress gz
+(or br) to also write precompressed files for the web server.
 
-Transecma does *not* help you with the problem of adding to your pages
-a <script> tag that loads the javascript file that contains the translations
-that correspond to your user's locale. This problem depends on which
-web framework you are using, but it should be very easy to solve.
+Instead of running po2json at build time, a Pyramid application can serve
+the translations for the locale of each request, compiled once per process
+by a CatalogCache: see PyramidStarter.enable_translation_catalogs().
+With other web frameworks, adding to your pages a <script> tag that loads
+the translations that correspond to your user's locale is up to you.
+
+Pages whose templates use only a few messages need not load the whole
+catalog: po2json --subset (or the `subsets` argument of compile_dir and
+CatalogCache) writes smaller files with just the messages found in
+the given templates.
 
 The final part of the solution is transecma.js, a javascript file that
 contains functions to perform translations based on the
@@ -33,6 +41,7 @@ with values from your application.
 from __future__ import unicode_literals  # unicode by default
 import os
 import re
+from mootiro_web.files import atomic_write, hash_file
 
 here = os.path.abspath(os.path.dirname(__file__))
 
@@ -47,11 +56,52 @@ def exists(path):
     return True
 
 
+# A javascript string literal, in double or single quotes
+STRING = r'''(?:"((?:[^"\\\n]|\\.)*)"|'((?:[^'\\\n]|\\.)*)')'''
+ESCAPE = re.compile(r'\\(u[0-9a-fA-F]{4}|x[0-9a-fA-F]{2}|.)')
+ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f',
+           'v': '\v', '0': '\0'}
+# A locale name such as "pt", "pt_BR", "sr_Latn_RS" or "ca_ES@valencia"
+LOCALE = re.compile(r'^[A-Za-z]{2,3}(?:_[A-Za-z0-9]+)*(?:@[A-Za-z]+)?$')
+_call_regexes = {}
+
+
+def call_regex(keywords):
+    '''Returns a single compiled regular expression that finds calls to
+    any of the `keywords` (function names) with a string argument and,
+    optionally, a second string argument (the plural). Cached.
+    '''
+    keywords = tuple(sorted(keywords, key=lambda k: (-len(k), k)))
+    rx = _call_regexes.get(keywords)
+    if rx is None:
+        rx = _call_regexes[keywords] = re.compile(
+            r'(?<![\w$])(' + '|'.join(re.escape(k) for k in keywords) +
+            r')\s*\(\s*' + STRING + r'(?:\s*,\s*' + STRING + r')?\s*[,)]')
+    return rx
+
+
+def unescape(literal):
+    '''Returns the value of the contents of a javascript string literal.'''
+    def replace(match):
+        escape = match.group(1)
+        if len(escape) > 1:  # \uXXXX or \xXX
+            return unichr(int(escape[1:], 16))
+        return ESCAPES.get(escape, escape)
+    return ESCAPE.sub(replace, literal) if '\\' in literal else literal
+
+
 def extract_jquery_templates(fileobj, keywords, comment_tags, options):
     """Extracts translation messages from query template files.
 
     This is a plugin to Babel, written according to http://babel.edgewall.org/wiki/Documentation/0.9/messages.html#writing-extraction-methods
 
+    Strings may contain escaped quotes. A call with 2 strings, such as
+    _("One item", "[0] items", n), is a plural message. Babel keeps only
+    the arguments named by the spec of each keyword, and the spec of "_"
+    is just the first argument; so plural messages are yielded under
+    PLURAL_KEYWORD ("ngettext", which is among Babel's default keywords)
+    when it is one of the `keywords`, whichever function was called.
+
     :param fileobj: the file-like object the messages should be extracted
                     from
     :param keywords: a list of keywords (i.e. function names) that should
@@ -63,57 +113,187 @@ def extract_jquery_templates(fileobj, keywords, comment_tags, options):
              tuples
     :rtype: ``iterator``
     """
-    # print 'Keywords: {}. Options: {}'.format(keywords, options)
     encoding = options.get('encoding', 'utf-8')
+    plural_keyword = PLURAL_KEYWORD if PLURAL_KEYWORD in keywords else None
     comments = []
-    funcname = message = None
-    def new_regex(keyword, quote):
-        # TODO: Allow plural messages, too
-        return re.compile( \
-            keyword + \
-            "\("    +  # open parentheses to call function
-            quote   +  # string start
-            # TODO: Allow an escaped quote:
-            "([^" + quote + "]+)" +  # capture: anything but a quote
-            quote   +  # string end
-            "\)"       # close parentheses (function call)
-        )
-    rx = []
-    for keyword in keywords:
-        rx.append(new_regex(keyword, '"'))
-        rx.append(new_regex(keyword, "'"))
-    # We have compiled our regular expressions, so now use them on the file
+    # One regular expression for all keywords and quotes; each line is
+    # scanned once.
+    rx = call_regex(keywords)
     for lineno, line in enumerate(fileobj, 1):
+        if b'(' not in line:  # much faster than the regular expression
+            continue
         line = line.decode(encoding)
-        for r in rx:
-            for match in r.finditer(line):
-                yield (lineno, funcname, match.group(1), comments)
+        for match in rx.finditer(line):
+            groups = match.groups()
+            singular = groups[1] if groups[1] is not None else groups[2]
+            plural = groups[3] if groups[3] is not None else groups[4]
+            if not singular:
+                continue
+            funcname = match.group(1)
+            if plural is None:
+                message = unescape(singular)
+            else:
+                message = (unescape(singular), unescape(plural))
+                funcname = plural_keyword or funcname
+            yield (lineno, funcname, message, comments)
+
+
+KEYWORDS = ('_', 'tr', 'gettext')  # the names transecma.js recommends
+PLURAL_KEYWORD = 'ngettext'  # whose Babel spec keeps 2 arguments
+
+
+def template_messages(paths, keywords=KEYWORDS, encoding='utf-8'):
+    '''Returns the set of the message IDs used in the jquery templates
+    (or javascript files) at `paths`, as found by extract_jquery_templates.
+    '''
+    ids = set()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for lineno, funcname, message, comments in \
+                    extract_jquery_templates(f, keywords, [],
+                                             dict(encoding=encoding)):
+                if isinstance(message, tuple):  # singular and plural
+                    ids.update(message)
+                else:
+                    ids.add(message)
+    return ids
+
+
+def select(translations, message_ids):
+    '''Returns the subset of the `translations` dictionary that a page
+    needs, given the `message_ids` its templates use.
+    '''
+    return {k: translations[k] for k in message_ids if k in translations}
 
 
 def po2dict(stream, locale, use_fuzzy=False):
     '''Given a `stream` (a file-like object) and a locale, returns a
     dictionary of the message IDs and translation strings.
+    Plural messages become 2 entries: the singular and the plural message
+    IDs map to the first and second translated forms, as transecma.js
+    expects.
     '''
     from babel.messages.pofile import read_po
     catalog = read_po(stream, locale)
     messages = [m for m in catalog if m.string]
     if not use_fuzzy:
         messages[1:] = [m for m in messages[1:] if not m.fuzzy]
-    messages.sort()
-    return {message.id: message.string for message in messages}
+    d = {}
+    for message in messages:
+        if isinstance(message.id, (list, tuple)):
+            for key, value in zip(message.id, message.string):
+                if value:
+                    d[key] = value
+        else:
+            d[message.id] = message.string
+    return d
+
+
+def mo2dict(path):
+    '''Given the `path` to a compiled .mo translation file, returns a
+    dictionary of the message IDs and translation strings, like po2dict,
+    but much faster, since the file is memory-mapped and Babel is not used.
+    Plural messages become 2 entries: the singular and the plural message
+    IDs map to the first and second translated forms, as transecma.js
+    expects. Message contexts are ignored.
+    '''
+    import mmap
+    from struct import unpack_from
+    with open(path, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            mm = b''
+    try:
+        if len(mm) < 28:
+            raise ValueError('"{}" is not a .mo file.'.format(path))
+        magic = unpack_from(b'<I', mm, 0)[0]
+        if magic == 0x950412de:
+            order = '<'
+        elif magic == 0xde120495:
+            order = '>'
+        else:
+            raise ValueError('"{}" is not a .mo file.'.format(path))
+        count, ids_at, strs_at = unpack_from(
+            (order + '4x3I').encode('ascii'), mm, 4)
+        table = (order + '{}I'.format(2 * count)).encode('ascii')
+        ids = unpack_from(table, mm, ids_at)
+        strs = unpack_from(table, mm, strs_at)
+        messages = [(mm[ids[i + 1]:ids[i + 1] + ids[i]],
+                     mm[strs[i + 1]:strs[i + 1] + strs[i]])
+                    for i in range(0, 2 * count, 2)]
+    finally:
+        if not isinstance(mm, bytes):
+            mm.close()
+    encoding = 'utf-8'
+    for msgid, msgstr in messages:
+        if msgid == b'':  # the header
+            match = re.search(br'charset=([\w-]+)', msgstr)
+            if match:
+                encoding = match.group(1).decode('ascii')
+    # Decoding 2 big strings is much faster than decoding each message
+    ids = b'\x01'.join([m[0] for m in messages])
+    strs = b'\x01'.join([m[1] for m in messages])
+    separators = len(messages) - 1
+    if ids.count(b'\x01') == strs.count(b'\x01') == separators:
+        messages = zip(ids.decode(encoding).split('\x01'),
+                       strs.decode(encoding).split('\x01'))
+    else:  # some message contains the separator
+        messages = [(i.decode(encoding), s.decode(encoding))
+                    for i, s in messages]
+    d = {}
+    for msgid, msgstr in messages:
+        if not msgstr:
+            continue
+        if '\x00' in msgid or '\x04' in msgid:  # plural or context
+            forms = msgstr.split('\x00')
+            for key, value in zip(msgid.split('\x04')[-1].split('\x00'),
+                                  forms):
+                if value:
+                    d[key] = value
+        else:
+            d[msgid] = msgstr
+    return d
+
+
+def iter_json(structure, variable_name=None, indent=1, compact=False, **k):
+    '''Generates, piece by piece, the output of make_json(), so it can be
+    written to a file without building the whole string in memory.
+    '''
+    import json
+    if variable_name:
+        yield '{0} = '.format(variable_name)
+    if compact and isinstance(structure, dict):
+        # Encode 1000 items at a time, which is about as fast as
+        # encoding the whole dictionary at once, using much less memory.
+        k.setdefault('separators', (',', ':'))
+        items = list(structure.items())
+        for start in range(0, max(len(items), 1), 1000):
+            yield ('{' if start == 0 else ',') + json.dumps(
+                dict(items[start:start + 1000]), **k)[1:-1] \
+                .replace('/', '\\/')
+        yield '}'
+    elif compact:
+        k.setdefault('separators', (',', ':'))
+        for chunk in json.JSONEncoder(**k).iterencode(structure):
+            yield chunk.replace('/', '\\/')
+    else:
+        yield json.dumps(structure, indent=indent, **k).replace('/', '\\/')
+    if variable_name:
+        yield ';\n'
 
 
-def make_json(structure, variable_name=None, indent=1, **k):
+def make_json(structure, variable_name=None, indent=1, compact=False, **k):
     '''Converts something into a json string, optionally attributing the result
     to a variable.
 
     It also escapes the forward slash, making the result suitable
     to be included in an HTML <script> tag.
+
+    If `compact`, there is no whitespace.
     '''
-    import json
-    s = json.dumps(structure, indent=indent, **k).replace('/', '\/')
-    return "{0} = {1};\n".format(variable_name, s) if variable_name \
-        else s
+    return ''.join(iter_json(structure, variable_name=variable_name,
+                             indent=indent, compact=compact, **k))
 
 
 def po2json(po_path, locale, variable_name=None, use_fuzzy=None):
@@ -123,8 +303,72 @@ def po2json(po_path, locale, variable_name=None, use_fuzzy=None):
     return make_json(d, variable_name=variable_name)
 
 
+MANIFEST = '.po2json.json'
+
+
+def _compile_locale(job):
+    '''Converts one .po file and writes out the .js files. This is a
+    module-level function so it can be run in a process pool.
+    '''
+    import codecs
+    with open(job['po_path']) as file:
+        translations = po2dict(file, job['locale'],
+                               use_fuzzy=job['use_fuzzy'])
+    out_path = job['out_path']
+    outputs = [(out_path, translations)] + [
+        (subset_path(out_path, name), select(translations, ids))
+        for name, ids in sorted(job['subsets'].items())]
+    for path, d in outputs:
+        with codecs.open(path, 'w', encoding=job['encoding']) as writer:
+            for chunk in iter_json(d, variable_name=job['variable_name'],
+                                   compact=job['compact']):
+                writer.write(chunk)
+            if job['lib']:
+                writer.write('\n')
+                writer.write(job['lib'])
+        for extension in job['compress']:
+            compress_file(path, extension)
+    return job['locale']
+
+
+def compress_file(path, extension):
+    '''Writes a precompressed copy of the file at `path`, so a web server
+    can serve it without compressing it on every request:
+    path + ".gz" (gzip) or path + ".br" (Brotli, which requires the
+    "brotli" package).
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    if extension == 'gz':
+        data = gzip_bytes(data)
+    elif extension == 'br':
+        import brotli
+        data = brotli.compress(data, mode=brotli.MODE_TEXT)
+    else:
+        raise ValueError('Unknown compression: "{}"'.format(extension))
+    with open(path + '.' + extension, 'wb') as f:
+        f.write(data)
+
+
+def subset_path(out_path, name):
+    '''Given "js/pt_BR.js" and a subset name, returns
+    "js/pt_BR.name.js".
+    '''
+    return out_path[:-3] + '.' + name + '.js'
+
+
+def _output_paths(out_path, subsets, compress):
+    '''Returns the paths of all the files written for one locale.'''
+    paths = [out_path] + [subset_path(out_path, name)
+                          for name in sorted(subsets)]
+    return paths + [path + '.' + extension
+                    for path in paths for extension in compress]
+
+
 def compile_dir(dir, domain, out_dir, variable_name=None, use_fuzzy=None,
-                encoding='utf8', include_lib=False):
+                encoding='utf8', include_lib=False, jobs=1,
+                incremental=False, subsets=None, keywords=KEYWORDS,
+                compact=False, compress=()):
     '''Given a `dir`, goes through all locale subdirectories in it,
     reads the .po translation files pertaining to `domain`, and then converts
     the translations to javascript files, which are written out to the
@@ -132,31 +376,251 @@ def compile_dir(dir, domain, out_dir, variable_name=None, use_fuzzy=None,
 
     If `include_lib` is True, the contents of transecma.js are appended to
     the end of each of the output files.
+
+    `jobs` is the number of processes that convert locales in parallel.
+
+    If `incremental` is True, locales whose .po file has not changed
+    (same mtime and size, or else same content) since the last run
+    are skipped. This is recorded in a manifest file in `out_dir`.
+    Changing the other arguments causes all locales to be converted again.
+
+    `subsets` maps names to lists of template (or javascript) files.
+    For each of them, another file, e.g. "pt_BR.name.js", is written,
+    containing only the messages used in those files, so that pages can
+    load just the translations they need.
+
+    If `compact`, the JSON has no whitespace. Each output file is
+    written as it is encoded, and also compressed into a sibling file
+    for each extension in `compress`: "gz" and/or "br" (see compress_file).
     '''
     import codecs
+    import json
     if include_lib:
         with codecs.open(os.path.join(here, 'transecma.js'),
                          encoding='utf8') as f:
             lib = f.read()
     else:
         lib = ''
-    jobs = []
+    todo = []
     if not exists(out_dir):
         os.makedirs(out_dir)
-    for locale in os.listdir(dir):
+    manifest_path = os.path.join(out_dir, MANIFEST)
+    subsets = {name: frozenset(template_messages(paths, keywords=keywords))
+               for name, paths in (subsets or {}).items()}
+    compress = sorted(compress)
+    options = [domain, variable_name, use_fuzzy, encoding, include_lib,
+               compact, compress,
+               {name: sorted(ids) for name, ids in subsets.items()}]
+    known = {}
+    if incremental and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get('options') == options:
+            known = manifest.get('locales', {})
+    entries = {}
+    for locale in sorted(os.listdir(dir)):
         po_path = os.path.join(dir, locale, 'LC_MESSAGES', domain + '.po')
         if os.path.exists(po_path):
             out_path = os.path.join(out_dir, locale + '.js')
-            jobs.append((locale, po_path, out_path))
-    for locale, po_path, out_path in jobs:
-        print('    Creating {0}'.format(out_path))
-        s = po2json(po_path, locale, variable_name=variable_name,
-            use_fuzzy=use_fuzzy)
-        with codecs.open(out_path, 'w', encoding=encoding) as writer:
-            writer.write(s)
-            if include_lib:
-                writer.write('\n')
-                writer.write(lib)
+            if incremental:
+                stat = os.stat(po_path)
+                entry = dict(mtime=stat.st_mtime, size=stat.st_size)
+                old = known.get(locale, {})
+                if (old.get('mtime'), old.get('size')) == \
+                        (entry['mtime'], entry['size']):
+                    entry['sha1'] = old.get('sha1')
+                else:
+                    entry['sha1'] = hash_file(po_path)
+                entries[locale] = entry
+                if entry['sha1'] == old.get('sha1') and all([exists(p)
+                        for p in _output_paths(out_path, subsets, compress)]):
+                    continue
+            todo.append(dict(locale=locale, po_path=po_path,
+                out_path=out_path, variable_name=variable_name,
+                use_fuzzy=use_fuzzy, encoding=encoding, lib=lib,
+                subsets=subsets, compact=compact, compress=compress))
+    for job in todo:
+        print('    Creating {0}'.format(job['out_path']))
+    if jobs > 1 and len(todo) > 1:
+        from multiprocessing import Pool
+        pool = Pool(min(jobs, len(todo)))
+        try:
+            pool.map(_compile_locale, todo)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for job in todo:
+            _compile_locale(job)
+    if incremental:
+        atomic_write(manifest_path, json.dumps(
+            dict(options=options, locales=entries), indent=1, sort_keys=True))
+
+
+def gzip_bytes(data, level=9):
+    '''Returns `data` gzipped, always the same for the same input.'''
+    from gzip import GzipFile
+    from io import BytesIO
+    buf = BytesIO()
+    with GzipFile(fileobj=buf, mode='wb', compresslevel=level,
+                  mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+class CompiledCatalog(object):
+    '''The javascript translations of one locale, ready to be served.'''
+    def __init__(self, locale, text):
+        from hashlib import sha1
+        self.locale = locale
+        self.body = text.encode('utf-8')
+        self.gzipped = gzip_bytes(self.body)
+        self.etag = sha1(self.body).hexdigest()
+
+
+class CatalogCache(object):
+    '''Compiles the translations of each locale at most once per process,
+    for a web application to serve them (see catalog_view_factory).
+    The translation files (.mo or .po) are looked up in `directories`,
+    in order, and compiled again only if they change (the cache key
+    contains their modification time and size).
+
+    `subsets` maps names to sets of message IDs (see template_messages),
+    so pages can load only the translations they use.
+    '''
+    def __init__(self, directories, domain, variable_name=None,
+                 use_fuzzy=False, subsets=None, compact=False):
+        import threading
+        if isinstance(directories, basestring):
+            directories = [directories]
+        self.directories = directories
+        self.domain = domain
+        self.variable_name = variable_name
+        self.use_fuzzy = use_fuzzy
+        self.subsets = subsets or {}
+        self.compact = compact
+        self._catalogs = {}  # (locale, subset) -> (stamp, CompiledCatalog)
+        self._lock = threading.Lock()
+
+    def find(self, locale):
+        '''Returns the path to the translation file of `locale`, or None.
+        Compiled .mo files are preferred, since they are faster to read,
+        unless the .po file is newer (it was edited after compiling) or
+        `use_fuzzy` is set (.mo files leave fuzzy translations out).
+        The locale usually comes from the URL, so anything that does not
+        look like a locale name (e.g. "../..") is refused outright.
+        '''
+        if not LOCALE.match(locale):
+            return None
+        for directory in self.directories:
+            base = os.path.join(directory, locale, 'LC_MESSAGES', self.domain)
+            found = [p for p in (base + '.mo', base + '.po') if exists(p)]
+            if len(found) == 2:
+                mo, po = found
+                if self.use_fuzzy or \
+                        os.path.getmtime(po) > os.path.getmtime(mo):
+                    return po
+                return mo
+            if found:
+                return found[0]
+
+    def load(self, path, locale):
+        '''Returns the translations in the file at `path` as a dict.'''
+        if path.endswith('.mo'):
+            return mo2dict(path)
+        with open(path) as file:
+            return po2dict(file, locale, use_fuzzy=self.use_fuzzy)
+
+    def compile(self, path, locale, subset=None):
+        translations = self.load(path, locale)
+        if subset is not None:
+            translations = select(translations, self.subsets[subset])
+        return CompiledCatalog(locale, make_json(translations,
+            variable_name=self.variable_name, compact=self.compact))
+
+    def get(self, locale, subset=None):
+        '''Returns the CompiledCatalog of `locale` -- only the messages
+        in the named `subset`, if given -- or None if there are no
+        translations for it. Raises KeyError if the subset is unknown.
+        '''
+        if subset is not None:
+            self.subsets[subset]
+        path = self.find(locale)
+        if path is None:
+            return None
+        stat = os.stat(path)
+        stamp = (path, stat.st_mtime, stat.st_size)
+        key = (locale, subset)
+        cached = self._catalogs.get(key)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        with self._lock:
+            cached = self._catalogs.get(key)
+            if not cached or cached[0] != stamp:
+                cached = self._catalogs[key] = \
+                    (stamp, self.compile(path, locale, subset))
+        return cached[1]
+
+
+def accepts_gzip(accept_encoding):
+    '''Given the value of an Accept-Encoding header, returns True if
+    the client accepts gzip.
+    '''
+    qualities = {}
+    for part in (accept_encoding or '').split(','):
+        params = part.split(';')
+        q = 1.0
+        for param in params[1:]:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[params[0].strip().lower()] = q
+    return qualities.get('gzip', qualities.get('x-gzip',
+                         qualities.get('*', 0.0))) > 0
+
+
+def catalog_view_factory(cache):
+    '''Returns a Pyramid view that serves, as javascript, the translations
+    compiled by the CatalogCache `cache`. The locale comes from the
+    "locale" part of the route, if any, or else from Pyramid's locale
+    negotiation. A "subset" part of the route, if any, names one of the
+    subsets of the cache. Responses have strong ETags (a "304 Not Modified"
+    is returned when they match) and are gzipped if the client accepts.
+    Enable it with PyramidStarter.enable_translation_catalogs().
+    '''
+    from pyramid.httpexceptions import HTTPNotFound, HTTPNotModified
+    from pyramid.i18n import get_locale_name
+    from pyramid.response import Response
+
+    def catalog_view(request):
+        matchdict = request.matchdict or {}
+        locale = matchdict.get('locale')
+        vary = ['Accept-Encoding']
+        if not locale:
+            locale = get_locale_name(request)
+            vary += ['Accept-Language', 'Cookie']
+        subset = matchdict.get('subset')
+        if subset is not None and subset not in cache.subsets:
+            return HTTPNotFound()
+        compiled = cache.get(locale, subset)
+        if compiled is None:
+            return HTTPNotFound()
+        gzipped = accepts_gzip(request.headers.get('Accept-Encoding'))
+        etag = compiled.etag + ('-gzip' if gzipped else '')
+        headers = [(b'ETag', '"{}"'.format(etag).encode('ascii')),
+                   (b'Vary', ', '.join(vary).encode('ascii'))]
+        if etag in request.if_none_match:
+            return HTTPNotModified(headers=headers)
+        response = Response(body=compiled.gzipped if gzipped
+            else compiled.body, headerlist=headers + [(b'Content-Type',
+                b'application/javascript; charset=utf-8')])
+        if gzipped:
+            response.content_encoding = 'gzip'
+        return response
+    return catalog_view
 
 
 def po2json_command():
@@ -190,12 +654,34 @@ def po2json_command():
                    help="javascript variable name for the translations object")
     p.add_argument('--include-lib', '-i', dest='include_lib', default=False,
                 action='store_true', help='include transecma.js in the output')
+    p.add_argument('--subset', '-s', dest='subsets', action='append',
+                   default=[], metavar='NAME=GLOB',
+                   help='also write NAME.js files containing only the '
+                   'messages used in the files matching GLOB (repeatable)')
+    p.add_argument('--compact', '-c', dest='compact', default=False,
+                   action='store_true', help='no whitespace in the output')
+    p.add_argument('--compress', '-z', dest='compress', action='append',
+                   default=[], choices=['gz', 'br'],
+                   help='also write precompressed .js.gz or .js.br files '
+                   '(repeatable)')
+    p.add_argument('--jobs', '-j', dest='jobs', type=int, default=1,
+                   help='number of processes to use (default %(default)s)')
+    p.add_argument('--incremental', '-u', dest='incremental', default=False,
+                action='store_true', help='skip locales whose .po files '
+                'have not changed since the last run')
     d = p.parse_args()
     if not d.dir:
         p.print_usage()
         return
+    from glob import glob
+    subsets = {}
+    for subset in d.subsets:
+        name, _, pattern = subset.partition('=')
+        subsets.setdefault(name, []).extend(glob(pattern))
     compile_dir(d.dir, d.domain, d.out_dir, variable_name=d.variable_name,
-                use_fuzzy=d.use_fuzzy, include_lib=d.include_lib)
+                use_fuzzy=d.use_fuzzy, include_lib=d.include_lib,
+                jobs=d.jobs, incremental=d.incremental, subsets=subsets,
+                compact=d.compact, compress=d.compress)
 
 
 if __name__ == '__main__':
@@ -85,6 +85,7 @@ def get_request_class(deps, settings, User=None, sas=None):
 
     This is obsolete because it uses the old page_deps module.
     get_request_class2() is preferred; it uses the web_deps module.
+    Until you migrate, pass a page_deps.FastDepsRegistry as `deps`.
     '''
     if not User:
         from .models import user as user_module
@@ -99,13 +100,14 @@ def get_request_class(deps, settings, User=None, sas=None):
     from pyramid.request import Request
     from pyramid.security import authenticated_userid
     from ..page_deps import PageDeps
+    page_class = getattr(deps, 'page_class', PageDeps)
     if not sas:
         from .models.user import sas
 
     class MootiroRequest(Request):
         def __init__(self, *a, **kw):
             super(MootiroRequest, self).__init__(*a, **kw)
-            self.page_deps = PageDeps(deps)
+            self.page_deps = page_class(deps)
 
         @reify
         def user(self):
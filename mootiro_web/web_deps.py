@@ -60,6 +60,8 @@ What about CSS stylesheets? Just call css() instead of lib():
     deps.css('deform', url="/deform/css/form.css", deps='jquery.ui')
 
 They, too, can depend on other stylesheets, which are then output first.
+Stylesheets (and libraries) that do not depend on each other are output
+in the order they were declared, so the CSS cascade is predictable.
 
 Often javascript libraries work together with certain CSS stylesheets.
 So we have a notion of a *package*:
@@ -131,6 +133,18 @@ Secondly include this just before the </body> tag:
 
 Alternatively, use "deps.lib.tags" and "deps.script.tags".
 
+Scripts block the rendering of the page while they are loaded. To avoid
+that, a library can be declared with a loading mode: "defer", "async"
+or "module":
+
+    deps.lib('jquery.ui', url='/static/lib/jquery.ui.js', deps='jquery',
+        load='defer')
+
+Dependencies still run first: any script that depends on a deferred one
+is deferred, too, and an async script that has dependencies (or
+dependents) is deferred instead. When a page has deferred libraries,
+bottom_output runs the ad hoc script fragments on DOMContentLoaded.
+
 You can also simply get lists of URLs (already sorted):
 
     request.deps.css.urls
@@ -202,6 +216,64 @@ not every javascript library is worth compressing. The reality we have
 experienced is we either want 3 alternative URLs, or just one. Anyway,
 suit yourself in your own url_provider implementation.
 
+Deployment: Bundles
+===================
+
+Each library and stylesheet is linked in its own tag, which means many
+round trips for slow clients. Alternatively, web_deps can concatenate
+the files required by each page into a single bundle. Declare
+the file path of each local resource and pass a Bundler to WebDeps:
+
+    bundler = Bundler('/var/cache/myapp/bundles', url_prefix='/bundles')
+    deps = WebDeps(bundler=bundler)
+    deps.lib('jquery', url="/static/lib/jquery-1.7.1.min.js",
+        path='/srv/myapp/static/lib/jquery-1.7.1.min.js')
+
+Now each page gets one script tag (and one stylesheet link) whose URL
+contains a hash of the content. Resources without a path, such as
+those on a CDN, are still linked separately. The bundler is also a
+WSGI application that serves the bundles; in Pyramid, call
+PyramidStarter.enable_bundles(bundler).
+
+For tiny files, an extra request costs more than the bytes. If you pass
+`inline_below=1024` to WebDeps, local files smaller than 1 KB are read
+once, on close(), and their content is output in <style> and <script>
+tags instead of links.
+
+Deployment: Cache-busting URLs
+==============================
+
+To serve static files with far-future Expires headers, use a
+Fingerprinter as the url_provider. When close() is called it hashes each
+file that has a "path" and appends the hash to its URL. The hashes are
+stored in a manifest file, so other worker processes do not hash
+everything again:
+
+    deps = WebDeps(url_provider=Fingerprinter('/var/cache/myapp.json'))
+
+Inspecting the graph
+====================
+
+deps.to_json() and deps.to_dot() export everything that was declared;
+the latter can be drawn with Graphviz ("dot -Tsvg"). To find out what
+your pages actually pull, create WebDeps(report=True); then
+deps.report.text() lists each distinct set of requirements, how many
+pages were served with it and how many bytes of local files it links.
+
+Flushing the head early
+=======================
+
+A streaming renderer can send the <head> before the body is rendered,
+if the view requires its stylesheets up front -- either in its code or
+with the declare_deps decorator:
+
+    @declare_deps(css='deform', package='deform')
+    def edit(self):
+        ...
+
+Stylesheets that the rest of the template still requires after
+top_output has been rendered are not lost: bottom_output links them.
+
 Advantages over page_deps
 =========================
 
@@ -233,7 +305,14 @@ https://github.com/it3s/mootiro_web/issues
 
 
 from __future__ import unicode_literals  # unicode by default
-from .memoize import memoize
+from functools import wraps
+from hashlib import sha1
+from heapq import heapify, heappop, heappush
+import os
+import re
+import threading
+from .files import atomic_write, hash_file
+from .memoize import memoize, hashable_key
 try:
     from cStringIO import StringIO
 except ImportError:
@@ -266,6 +345,16 @@ def uniquefy(seq, id_fun=lambda x: x):
     return result
 
 
+class DepsError(RuntimeError):
+    '''Raised by close() when the dependency graph is broken.
+    The `problems` attribute is a list of all the problems found.
+    '''
+    def __init__(self, problems):
+        self.problems = problems
+        super(DepsError, self).__init__('The dependency graph has {} '
+            'problem(s):\n  '.format(len(problems)) + '\n  '.join(problems))
+
+
 class Dependency(object):
     def __init__(self, handle, deps='', **kw):
         '''You can store whatever attributes you like by providing keyword
@@ -299,6 +388,7 @@ class Dependency(object):
 class DepsRegistry(object):
     def __init__(self):
         self.items = {}
+        self.declared = []  # the items in the order they were admitted
 
     def admit(self, *deps):
         '''The arguments must be Dependency instances.'''
@@ -306,38 +396,148 @@ class DepsRegistry(object):
             if self.items.has_key(dep.handle):
                 raise KeyError('{} already registered.'.format(dep.handle))
             self.items[dep.handle] = dep
+            self.declared.append(dep)
+
+    def check(self):
+        '''Finds every actual dependency object from declared handle strings,
+        then returns a list of the problems in the graph: unknown handles
+        and circular dependencies. All of them, in one linear pass.
+        '''
+        problems = []
+        for item in self.declared:
+            for handle in item.dep_handles:
+                if handle not in self.items:
+                    problems.append('"{}" depends on unknown "{}".'
+                                    .format(item.handle, handle))
+            item.deps = uniquefy([self.items[d] for d in item.dep_handles
+                                  if d in self.items])
+        problems.extend(['Circular dependency: {}.'.format(
+            ' -> '.join(d.handle for d in cycle))
+            for cycle in self._find_cycles()])
+        return problems
+
+    def _find_cycles(self):
+        '''Depth-first search that returns one cycle (a list of items) for
+        each back edge found. Iterative, so deep graphs cannot exhaust
+        the stack.
+        '''
+        NEW, OPEN, DONE = 0, 1, 2
+        state = dict.fromkeys(self.declared, NEW)
+        cycles = []
+        for root in self.declared:
+            if state[root] != NEW:
+                continue
+            state[root] = OPEN
+            path = [root]
+            stack = [iter(root.deps)]
+            while stack:
+                for dep in stack[-1]:
+                    if state[dep] == NEW:
+                        state[dep] = OPEN
+                        path.append(dep)
+                        stack.append(iter(dep.deps))
+                        break
+                    elif state[dep] == OPEN:
+                        cycles.append(path[path.index(dep):] + [dep])
+                else:
+                    state[path.pop()] = DONE
+                    stack.pop()
+        return cycles
 
     def close(self):
-        # Find every actual dependency object from declared handle strings
-        for item in self.items.itervalues():
-            item.deps = \
-                uniquefy([self.items[d] for d in item.dep_handles])
-                # , id_fun=lambda d: d.handle)
+        problems = self.check()
+        if problems:
+            raise DepsError(problems)
+        self._rank()
         # Do not allow admit() to work anymore
         def admit(dep):
             raise RuntimeError \
                 ('Cannot admit() because registry is already closed.')
         self.admit = admit
 
-    @memoize(100, keymaker=repr)
+    def _rank(self):
+        '''Computes, once, a global topological order of the items (each item
+        comes after its dependencies; unrelated items keep the order in
+        which they were declared) and the transitive closure of each item,
+        as a bitset.
+        The graph must have been checked already, since items in a cycle
+        would never be ranked.
+        '''
+        position = {dep: i for i, dep in enumerate(self.declared)}
+        pending = {dep: len(dep.deps) for dep in self.declared}
+        dependents = {dep: [] for dep in self.declared}
+        for dep in self.declared:
+            for d in dep.deps:
+                dependents[d].append(dep)
+        ready = [(position[dep], dep) for dep in self.declared
+                 if not dep.deps]
+        heapify(ready)
+        self.ranks = ranks = {}
+        self.by_rank = []
+        self.closures = closures = {}  # bitsets, one bit per rank
+        while ready:
+            i, dep = heappop(ready)
+            ranks[dep] = len(self.by_rank)
+            self.by_rank.append(dep)
+            closure = 1 << ranks[dep]
+            for d in dep.deps:
+                closure |= closures[d]
+            closures[dep] = closure
+            for dependent in dependents[dep]:
+                pending[dependent] -= 1
+                if not pending[dependent]:
+                    heappush(ready, (position[dependent], dependent))
+
+    def requirement(self, items):
+        '''Returns the *requirement set* of `items`, which can be either
+        a comma-delimited string of dependency names, a list of actual
+        Dependency objects or a requirement set (returned as is).
+
+        A requirement set is the union of the transitive closures of the
+        items -- an int where bit n stands for the item of rank n.
+        Therefore it does not depend on the order of the items, nor on
+        whether their dependencies were also listed, and it makes
+        a small cache key.
+
+        This method can only be called after close().
+        '''
+        if isinstance(items, (int, long)):
+            return items
+        if isinstance(items, basestring):
+            items = [self.items[h] for h in uncommafy(items)]
+        closures = self.closures
+        bits = 0
+        for item in items:
+            bits |= closures[item]
+        return bits
+
     def summon(self, items):
         '''The parameter `items` can be either a comma-delimited string of
-        dependency names, or a list of actual Dependency objects.
+        dependency names, a list of actual Dependency objects,
+        or a requirement set.
 
         Returns a list of dependency objects,
         plus their dependencies, in the correct order.
 
-        How is it done? A flat list of dependencies is created leaf-to-root,
-        then reversed and uniquefied.
+        How is it done? close() has already computed the transitive
+        closure of each item, as a bitset where bit n stands for the item
+        of rank n. So this is just a union of bitsets, read from the
+        lowest bit up. The cost does not depend on the shape of the graph.
 
         This method can only be called after close().
         '''
-        flat = []
-        if isinstance(items, basestring):
-            items = [self.items[h] for h in uncommafy(items)]
-        for item in items:
-            flat.extend(item.recursive_deps())
-        return uniquefy(reversed(flat))
+        return self._summon(self.requirement(items))
+
+    @memoize(100, keymaker=hashable_key, lock=True)
+    def _summon(self, bits):
+        by_rank = self.by_rank
+        flags = bin(bits)[:1:-1]  # lowest bit first
+        result = []
+        rank = flags.find('1')
+        while rank != -1:
+            result.append(by_rank[rank])
+            rank = flags.find('1', rank + 1)
+        return result
 
 
 class CallableRegistry(DepsRegistry):
@@ -356,24 +556,320 @@ class CallableRegistry(DepsRegistry):
         self.admit(self.item_class(handle, deps, **kw))
 
 
+DEFERRED = ('defer', 'module')  # loading modes that run after parsing
+
+
+def default_path_provider(resource):
+    '''Returns the "path" of a resource: the local file it is served from.'''
+    return getattr(resource, 'path', None)
+
+
 class WebDepsRegistry(CallableRegistry):
-    def __init__(self, url_provider, tag_format):
+    def __init__(self, url_provider, tag_format, extension=None,
+                 bundler=None, load_formats=None, inline_format=None,
+                 inline_below=None, path_provider=default_path_provider):
+        '''`load_formats` maps each loading mode a dependency may declare
+        -- e.g. deps.lib('x', url='/x.js', load='defer') -- to the
+        tag_format used for it.
+
+        Local files smaller than `inline_below` bytes are read on close()
+        and output in the page, with `inline_format`, instead of linked.
+        '''
         super(WebDepsRegistry, self).__init__()
         self.url_provider = url_provider
         self.tag_format = tag_format
+        self.extension = extension
+        self.bundler = bundler
+        self.load_formats = load_formats or {}
+        self.load_formats[None] = tag_format
+        self.inline_format = inline_format
+        self.inline_below = inline_below
+        self.path_provider = path_provider
+        self.inlined = {}  # Dependency -> content
+
+    def check(self):
+        problems = super(WebDepsRegistry, self).check()
+        for item in self.declared:
+            load = getattr(item, 'load', None)
+            if load not in self.load_formats:
+                problems.append('"{}" has an unknown load mode "{}".'
+                                .format(item.handle, load))
+        return problems
+
+    def close(self):
+        super(WebDepsRegistry, self).close()
+        self._compute_loads()
+        if self.inline_below and self.inline_format:
+            self._read_inlined()
+
+    def _read_inlined(self):
+        '''Reads, once, the small files that will be output inline.
+        Deferred and async scripts are never inlined, since that would
+        change when they run.
+        '''
+        closing_tag = re.compile(r'</(?={})'.format(
+            'script' if self.extension == 'js' else 'style'), re.IGNORECASE)
+        for item in self.declared:
+            path = self.path_provider(item)
+            if not path or self.loads[item] is not None \
+                    or os.path.getsize(path) >= self.inline_below:
+                continue
+            with open(path, 'rb') as f:
+                content = f.read().decode('utf-8')
+            # The content must not close the tag that contains it
+            self.inlined[item] = closing_tag.sub(r'<\/', content)
+
+    def _compute_loads(self):
+        '''Decides how each dependency is actually loaded, so that
+        dependencies always run first. Deferred scripts run in document
+        order, after the blocking ones; therefore a script that depends
+        on a deferred one must be deferred, too. Async scripts run in
+        any order, so they stay async only if nothing depends on them
+        and they depend on nothing; otherwise they are deferred.
+        '''
+        depended = set([d for item in self.declared for d in item.deps])
+        self.loads = loads = {}
+        for item in self.by_rank:
+            load = getattr(item, 'load', None)
+            if load == 'async' and (item.deps or item in depended):
+                load = 'defer'
+            if load is None and \
+                    any(loads[d] in DEFERRED for d in item.deps):
+                load = 'defer'
+            loads[item] = load
 
-    @memoize(100, keymaker=repr)
     def urls(self, items):
         '''Recommended for use in your templating language. Returns a list of
-        the URLs for the dependencies required by this page.
+        the URLs for the dependencies required by this page
+        (except those output inline).
         '''
-        return [self.url_provider(o) for o in self.summon(items)]
+        return self._urls(self.requirement(items))
+
+    def links(self, items):
+        '''Like urls(), but returns (url, load) pairs, where `load` is how
+        the dependency is loaded (None, "defer", "async" or "module").
+        '''
+        return [(url, load) for url, load, content
+                in self._links(self.requirement(items)) if content is None]
 
-    @memoize(100, keymaker=repr)
     def tags(self, items):
         '''Returns a string containing the HTML script tags.'''
-        return '\n'.join([self.tag_format.format(url) \
-            for url in self.urls(items)])
+        return self._tags(self.requirement(items))
+
+    def deferred(self, items):
+        '''Returns True if some of the dependencies of `items` are
+        loaded after the page is parsed (defer or module).
+        '''
+        return any(load in DEFERRED for url, load, content
+                   in self._links(self.requirement(items)))
+
+    @memoize(100, keymaker=hashable_key, lock=True)
+    def _links(self, bits):
+        '''Returns a list of (url, load, content) tuples. `content` is
+        None unless the dependency is output inline.
+        '''
+        links = []
+        linked = []  # consecutive dependencies that are not inlined
+        for dep in self._summon(bits) + [None]:
+            if dep is not None and dep not in self.inlined:
+                linked.append(dep)
+                continue
+            if self.bundler:
+                links.extend([(url, load, None) for url, load in
+                    self.bundler.links(linked, self.extension,
+                                       self.url_provider, self.loads.get)])
+            else:
+                links.extend([(self.url_provider(o), self.loads.get(o), None)
+                              for o in linked])
+            linked = []
+            if dep is not None:
+                links.append((self.url_provider(dep), None,
+                              self.inlined[dep]))
+        return links
+
+    @memoize(100, keymaker=hashable_key, lock=True)
+    def _urls(self, bits):
+        return [url for url, load, content in self._links(bits)
+                if content is None]
+
+    @memoize(100, keymaker=hashable_key, lock=True)
+    def _tags(self, bits):
+        return '\n'.join([self.load_formats[load].format(url)
+            if content is None else self.inline_format.format(content)
+            for url, load, content in self._links(bits)])
+
+
+class Bundler(object):
+    '''Concatenates the local files required by a page into one bundle,
+    named after a hash of its content, and stored in `directory`.
+    Pass an instance to the WebDeps constructor to enable bundling.
+
+    Bundles are made lazily, the first time a set of dependencies is
+    requested (use WebDeps.build_bundles() to make them at startup)
+    and are kept on disk, so other processes and restarts reuse them.
+    A Bundler is also a WSGI application that serves the bundles.
+
+    A resource is local if `path_provider` returns a file path for it
+    (by default, its "path" attribute). Other resources, e.g. on a CDN,
+    are linked as usual, and the local files around them are bundled
+    separately, so the order is preserved.
+    Beware of relative url() references in CSS files, which now are
+    relative to `url_prefix`.
+    '''
+    SEPARATORS = {'js': '\n;\n', 'css': '\n'}
+    CONTENT_TYPES = {'js': 'application/javascript; charset=utf-8',
+                     'css': 'text/css; charset=utf-8'}
+    NAME = re.compile(r'^[0-9a-f]{40}\.(js|css)$')
+
+    def __init__(self, directory, url_prefix='/bundles',
+                 path_provider=default_path_provider, encoding='utf-8'):
+        self.directory = directory
+        self.url_prefix = url_prefix.rstrip('/')
+        self.path_provider = path_provider
+        self.encoding = encoding
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def urls(self, deps, extension, url_provider):
+        '''Returns the URLs for a sorted list of Dependency objects:
+        one for each run of consecutive local files, plus the URLs of
+        non-local resources.
+        '''
+        return [url for url, load in self.links(deps, extension, url_provider)]
+
+    def links(self, deps, extension, url_provider, load=lambda dep: None):
+        '''Like urls(), but returns (url, load) pairs, where `load` is the
+        loading mode of the dependencies, as returned by the `load`
+        callable. Files with different loading modes are not bundled
+        together.
+        '''
+        links = []
+        run = []  # consecutive local dependencies with the same load
+        for dep in deps + [None]:
+            path = self.path_provider(dep) if dep else None
+            if path and (not run or load(run[0][0]) == load(dep)):
+                run.append((dep, path))
+                continue
+            if len(run) > 1:
+                links.append((self.bundle([p for d, p in run], extension),
+                              load(run[0][0])))
+            elif run:
+                links.append((url_provider(run[0][0]), load(run[0][0])))
+            run = [(dep, path)] if path else []
+            if dep and not path:
+                links.append((url_provider(dep), load(dep)))
+        return links
+
+    def bundle(self, paths, extension):
+        '''Concatenates the files, stores the result unless a bundle with the
+        same content already exists, and returns the URL of the bundle.
+        '''
+        parts = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                parts.append(f.read().decode(self.encoding))
+        content = self.SEPARATORS.get(extension, '\n').join(parts) \
+            .encode(self.encoding)
+        name = '{}.{}'.format(sha1(content).hexdigest(), extension)
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            # Other processes may be serving or writing the same bundle
+            atomic_write(path, content)
+        return '{}/{}'.format(self.url_prefix, name)
+
+    def __call__(self, environ, start_response):
+        '''WSGI application that serves the bundles. Their names change
+        with their content, so they are cached for a year.
+        '''
+        name = environ.get('PATH_INFO', '').rsplit('/', 1)[-1]
+        match = self.NAME.match(name)
+        path = os.path.join(self.directory, name)
+        if not match or not os.path.exists(path):
+            start_response(b'404 Not Found',
+                           [(b'Content-Type', b'text/plain')])
+            return [b'Not found']
+        etag = '"{}"'.format(name[:40]).encode('ascii')
+        if environ.get('HTTP_IF_NONE_MATCH') == etag:
+            start_response(b'304 Not Modified', [(b'ETag', etag)])
+            return []
+        with open(path, 'rb') as f:
+            content = f.read()
+        start_response(b'200 OK', [
+            (b'Content-Type', self.CONTENT_TYPES[match.group(1)].encode()),
+            (b'Content-Length', str(len(content)).encode()),
+            (b'Cache-Control', b'public, max-age=31536000'),
+            (b'ETag', etag)])
+        return [content]
+
+
+class Fingerprinter(object):
+    '''A url_provider that adds a hash of the content of each local file
+    to its URL, so the files can be served with far-future Expires
+    headers and browsers still notice new versions:
+
+        deps = WebDeps(url_provider=Fingerprinter('/var/cache/myapp.json'))
+        deps.lib('jquery', url="/static/lib/jquery.js",
+            path='/srv/myapp/static/lib/jquery.js')
+        # outputs /static/lib/jquery.js?v=0123456789ab
+
+    If `query` is empty, the hash goes into the file name instead --
+    /static/lib/jquery.0123456789ab.js -- and your web server must
+    map it back to the file.
+
+    The files are hashed once, when WebDeps.close() calls prepare().
+    The hashes are remembered, along with the size and modification time
+    of each file, in a JSON `manifest`, so that other processes
+    (or the next start) only hash the files that have changed.
+    Resources without a path (see `path_provider`) keep their URL.
+    '''
+    def __init__(self, manifest=None, query='v', length=12,
+                 url_provider=lambda resource: resource.url,
+                 path_provider=default_path_provider):
+        self.manifest = manifest
+        self.query = query
+        self.length = length
+        self.url_provider = url_provider
+        self.path_provider = path_provider
+        self.urls = {}  # Dependency -> fingerprinted URL
+
+    def __call__(self, resource):
+        url = self.urls.get(resource)
+        return url if url else self.url_provider(resource)
+
+    def prepare(self, resources):
+        '''Computes the URL of each resource, hashing only the files that
+        are not in the manifest or have changed since.
+        '''
+        import json
+        known = {}
+        if self.manifest and os.path.exists(self.manifest):
+            with open(self.manifest) as f:
+                known = json.load(f)
+        entries = {}
+        for resource in resources:
+            path = self.path_provider(resource)
+            if not path:
+                continue
+            st = os.stat(path)
+            entry = known.get(path)
+            if not entry or entry['mtime'] != st.st_mtime \
+                    or entry['size'] != st.st_size:
+                entry = dict(mtime=st.st_mtime, size=st.st_size,
+                             hash=hash_file(path))
+            entries[path] = entry
+            self.urls[resource] = self.fingerprint(
+                self.url_provider(resource), entry['hash'][:self.length])
+        if self.manifest and entries != known:
+            # Other processes may be reading it, so replace it atomically
+            atomic_write(self.manifest,
+                         json.dumps(entries, indent=1, sort_keys=True))
+
+    def fingerprint(self, url, fingerprint):
+        if self.query:
+            return '{}{}{}={}'.format(url, '&' if '?' in url else '?',
+                                      self.query, fingerprint)
+        base, ext = os.path.splitext(url)
+        return '{}.{}{}'.format(base, fingerprint, ext)
 
 
 class WebDeps(object):
@@ -392,72 +888,313 @@ class WebDeps(object):
     Then in each request you should instantiate the returned PageDeps.
     '''
 
-    def __init__(self, url_provider=lambda resource: resource.url):
+    def __init__(self, url_provider=lambda resource: resource.url,
+                 bundler=None, inline_below=None,
+                 path_provider=default_path_provider, report=False,
+                 minify_scripts=False, wrap_scripts=None):
         '''By default, the system will output URLs by looking into the "url"
         instance variable of resources. If needed, you can change this
         by providing a `url_provider` function here.
+
+        Pass a Bundler to output one bundle per page instead of
+        one tag per file.
+
+        Local files (those with a "path", or whatever `path_provider`
+        returns) smaller than `inline_below` bytes are read on close()
+        and output inside <script> and <style> tags instead of linked.
+
+        If `report` is True, `self.report` is a DepsReport that counts
+        the pages served with each distinct set of requirements.
+
+        `minify_scripts` and `wrap_scripts` are passed on to the
+        ScriptComponent of each page, as `minify` and `wrap`.
         '''
         self.lib = WebDepsRegistry(url_provider=url_provider,
-            tag_format='<script type="text/javascript" src="{}"></script>')
+            tag_format='<script type="text/javascript" src="{}"></script>',
+            extension='js', bundler=bundler, inline_below=inline_below,
+            path_provider=path_provider,
+            inline_format='<script type="text/javascript">\n{}\n</script>',
+            load_formats={
+                'defer': '<script type="text/javascript" src="{}" '
+                         'defer="defer"></script>',
+                'async': '<script type="text/javascript" src="{}" '
+                         'async="async"></script>',
+                'module': '<script type="module" src="{}"></script>'})
         self.css = WebDepsRegistry(url_provider=url_provider,
-            tag_format='<link rel="stylesheet" type="text/css" href="{}" />')
+            tag_format='<link rel="stylesheet" type="text/css" href="{}" />',
+            extension='css', bundler=bundler, inline_below=inline_below,
+            path_provider=path_provider,
+            inline_format='<style type="text/css">\n{}\n</style>')
+        self.bundler = bundler
         self.package = CallableRegistry()
+        self.report = DepsReport(self.lib, self.css, path_provider) \
+            if report else None
+        self.pages = []  # requirements declared up front; see declare_deps
+        self.script_options = dict(minify=minify_scripts, wrap=wrap_scripts)
         self._url_provider = url_provider
 
     def close(self):
         '''Finishes registration time and returns a factory that
         should be called for each request.
+
+        The whole graph is validated first; unknown handles and circular
+        dependencies are all reported together in a DepsError.
         '''
+        problems = ['lib ' + p for p in self.lib.check()] + \
+            ['css ' + p for p in self.css.check()] + \
+            ['package ' + p for p in self.package.check()]
+        for package in self.package.declared:
+            for attr, registry in (('libs', self.lib), ('css', self.css)):
+                for handle in uncommafy(getattr(package, attr, None)):
+                    if handle not in registry.items:
+                        problems.append('package "{}" wants unknown {} "{}".'
+                            .format(package.handle, attr, handle))
+        for page in self.pages:
+            for kind, registry in (('lib', self.lib), ('css', self.css),
+                                   ('package', self.package)):
+                for handle in uncommafy(page.get(kind)):
+                    if handle not in registry.items:
+                        problems.append('{} declares unknown {} "{}".'
+                            .format(page.get('view', 'A page'), kind, handle))
+        if problems:
+            raise DepsError(problems)
         self.lib.close()
         self.css.close()
         self.package.close()
+        # e.g. a Fingerprinter hashes the files now
+        prepare = getattr(self._url_provider, 'prepare', None)
+        if prepare:
+            prepare(self.lib.declared + self.css.declared)
         def factory():
-            return PageDeps(self.lib, self.css, self.package)
+            return PageDeps(self.lib, self.css, self.package, self.report,
+                            **self.script_options)
         return factory
 
+    def graph(self):
+        '''Returns the declared libs, stylesheets and packages as a
+        dictionary of lists of dictionaries, with their dependencies
+        and other attributes (url, path etc.), in declaration order.
+        '''
+        def describe(item):
+            d = dict(handle=item.handle, deps=list(item.dep_handles))
+            for k, v in vars(item).items():
+                if k not in ('handle', 'dep_handles', 'deps'):
+                    d[k] = v
+            return d
+        return dict(lib=[describe(i) for i in self.lib.declared],
+                    css=[describe(i) for i in self.css.declared],
+                    package=[describe(i) for i in self.package.declared])
+
+    def to_json(self, indent=1):
+        '''Exports the dependency graph as JSON.'''
+        import json
+        return json.dumps(self.graph(), indent=indent, sort_keys=True,
+                          default=repr)
+
+    def to_dot(self):
+        '''Exports the dependency graph in the DOT language of Graphviz.
+        Arrows point from each item to what it requires.
+        '''
+        lines = ['digraph web_deps {', '  rankdir=BT;']
+        node = lambda kind, handle: '"{}:{}"'.format(kind, handle)
+        graph = self.graph()
+        for kind, shape in (('lib', 'box'), ('css', 'ellipse'),
+                            ('package', 'folder')):
+            lines.append('  subgraph "cluster_{}" {{'.format(kind))
+            lines.append('    label="{}";'.format(kind))
+            for item in graph[kind]:
+                lines.append('    {} [label="{}", shape={}];'.format(
+                    node(kind, item['handle']), item['handle'], shape))
+            lines.append('  }')
+        for kind in ('lib', 'css', 'package'):
+            for item in graph[kind]:
+                targets = [(kind, h) for h in item['deps']]
+                if kind == 'package':
+                    targets += [('lib', h) for h in
+                                uncommafy(item.get('libs'))]
+                    targets += [('css', h) for h in
+                                uncommafy(item.get('css'))]
+                for target in targets:
+                    lines.append('  {} -> {};'.format(
+                        node(kind, item['handle']), node(*target)))
+        lines.append('}')
+        return '\n'.join(lines)
+
+    def build_bundles(self, *pages):
+        '''If there is a bundler, makes the bundles at once (instead of
+        on the first request) for each of the `pages`, which are
+        dictionaries such as {'lib': 'deform', 'css': 'deform, site'},
+        or else for the pages declared up front (see declare_deps).
+        Must be called after close().
+        '''
+        page_deps = PageDeps(self.lib, self.css, self.package)
+        for page in pages or self.pages:
+            page_deps.lib.requirement = page_deps.css.requirement = 0
+            page_deps.declare(lib=page.get('lib'), css=page.get('css'),
+                              package=page.get('package'))
+            page_deps.lib.urls
+            page_deps.css.urls
+
+
+def declare_deps(lib=None, css=None, package=None, attr='page_deps'):
+    '''View decorator that requires dependencies as soon as the view is
+    called, before the template starts rendering, so a streaming renderer
+    can flush the <head> (PageDeps.top_output) early:
+
+        @declare_deps(css='deform', package='deform')
+        def edit(self):
+            ...
+
+    The request is the first argument of the view or its "request"
+    attribute (as in a view class); its PageDeps is the request
+    attribute named `attr`. PyramidStarter.declare_deps_from_views()
+    collects these declarations, so WebDeps.close() validates them and
+    WebDeps.build_bundles() makes their bundles.
+    '''
+    spec = dict(lib=lib, css=css, package=package)
+    def decorator(view):
+        @wraps(view)
+        def wrapper(first, *a, **kw):
+            request = getattr(first, 'request', first)
+            getattr(request, attr).declare(**spec)
+            return view(first, *a, **kw)
+        wrapper.web_deps = spec
+        return wrapper
+    return decorator
+
 
 class PageDepsComponent(object):
-    def __init__(self, registry):
-        self._items = []
+    def __init__(self, registry, on_output=None):
+        self.requirement = 0  # See DepsRegistry.requirement()
         self.registry = registry
+        self.on_output = on_output  # called whenever the tags are output
 
     def __call__(self, handles):
         '''Adds one or more requirements to this page or request.'''
+        items = self.registry.items
+        closures = self.registry.closures
         for handle in uncommafy(handles):
-            self._items.append(self.registry.items[handle])
+            self.requirement |= closures[items[handle]]
 
     @property
     def sorted(self):
         '''Returns a list of dependency objects required by this page.'''
-        return self.registry.summon(self._items)
+        return self.registry.summon(self.requirement)
 
     @property
     def urls(self):
         '''Recommended for use in your templating language. Returns a list of
         the URLs for the dependencies required by this page.
         '''
-        return self.registry.urls(self._items)
+        return self.registry.urls(self.requirement)
+
+    @property
+    def links(self):
+        '''Returns (url, load) pairs; see DepsRegistry.links().'''
+        return self.registry.links(self.requirement)
 
     @property
     def tags(self):
         '''Returns a string containing the HTML script tags.'''
-        return self.registry.tags(self._items)
+        if self.on_output:
+            self.on_output()
+        return self.registry.tags(self.requirement)
+
+    @property
+    def deferred(self):
+        '''True if some of the scripts of this page are deferred.'''
+        return self.registry.deferred(self.requirement)
 
 
-class ScriptComponent(list):
+@memoize(1000, lock=True)
+def minify_script(script):
+    '''Strips the indentation, trailing whitespace and blank lines of a
+    javascript fragment. Line breaks are kept, since javascript may depend
+    on them to insert semicolons. (Whitespace at the start of lines inside
+    multiline template strings would be lost, too.)
+
+    Memoized, so repeated fragments are only processed once per process.
+    '''
+    return '\n'.join([line for line in
+                      [l.strip() for l in script.splitlines()] if line])
+
+
+class ScriptComponent(object):
+    '''The javascript fragments required by a page, in order and
+    without repetitions. It can be iterated, indexed and measured like
+    a list, but every addition goes through the same check for
+    repetitions, which costs O(1) thanks to a set. If `minify`, each fragment is passed through
+    minify_script(). `wrap` can be "iife", to wrap all the fragments
+    in a single function (so their variables are not global), or
+    "jquery", to run them when the DOM is ready, through jquery.
+    `lib` is the PageDepsComponent of the page's libraries; if some of
+    them are deferred, the fragments wait for the DOM to be loaded.
+    `on_output` is called whenever the fragments are output.
+    '''
+    WRAPPERS = {'iife': ('(function() {\n', '})();\n'),
+                'jquery': ('$(function() {\n', '});\n'),
+                'deferred': ("document.addEventListener('DOMContentLoaded', "
+                             "function() {\n", '});\n')}
+
+    def __init__(self, minify=False, wrap=None, lib=None, on_output=None):
+        self._scripts = []
+        self._seen = set()
+        self.minify = minify
+        self.wrap = wrap
+        self.lib = lib
+        self.on_output = on_output
+
     def __call__(self, script):  # Included just to keep a common API
-        if not script in self:
-            self.append(script)
+        if script not in self._seen:
+            self._seen.add(script)
+            self._scripts.append(script)
+
+    append = __call__
+
+    def extend(self, scripts):
+        for script in scripts:
+            self(script)
+
+    def remove(self, script):
+        self._scripts.remove(script)
+        self._seen.discard(script)
 
-    def output(self, tag=True):
+    def __iter__(self):
+        return iter(self._scripts)
+
+    def __len__(self):
+        return len(self._scripts)
+
+    def __getitem__(self, index):
+        return self._scripts[index]
+
+    def __contains__(self, script):
+        return script in self._seen
+
+    def output(self, tag=True, deferred=None):
+        '''If `deferred`, the scripts only run when the DOM is loaded,
+        which is after any deferred libraries they might use.
+        By default, that is the case if some of the page's libraries
+        are deferred.
+        '''
+        if self.on_output:
+            self.on_output()
         if not self:
             return '\n'
+        if deferred is None:
+            deferred = self.lib is not None and self.lib.deferred
+        wrappers = [self.WRAPPERS[w] for w in
+                    ('deferred' if deferred else None, self.wrap) if w]
         s = StringIO()
         if tag:
             s.write('<script type="text/javascript">\n')
+        for start, end in wrappers:
+            s.write(start)
         for o in self:
-            s.write(o)
+            s.write(minify_script(o) if self.minify else o)
             s.write('\n')
+        for start, end in reversed(wrappers):
+            s.write(end)
         if tag:
             s.write('</script>\n')
         return s.getvalue()
@@ -500,32 +1237,198 @@ class PackageComponent(object):
                 self._deps.script(package.script)
 
 
+def preload_tween_factory(handler, registry):
+    '''Pyramid tween that adds to HTML responses a "Link" header with
+    the preload hints of the PageDeps instance of the request.
+    Enable it with PyramidStarter.enable_preload_headers() or
+
+        config.add_tween('mootiro_web.web_deps.preload_tween_factory')
+
+    The PageDeps instance is looked up in the request attribute named by
+    the "web_deps.request_attr" setting (by default, "page_deps").
+    Other page objects there (such as those of mootiro_web.page_deps)
+    have no preload hints; their responses are left alone.
+    '''
+    attr = (registry.settings or {}).get('web_deps.request_attr',
+                                         'page_deps')
+    def preload_tween(request):
+        response = handler(request)
+        deps = getattr(request, attr, None)
+        if deps is not None and response.content_type == 'text/html':
+            value = getattr(deps, 'link_header', None)
+            if value:
+                response.headers.add(b'Link', value.encode('utf-8'))
+        return response
+    return preload_tween
+
+
+class DepsReport(object):
+    '''Counts the pages served with each distinct set of requirements
+    (libs and stylesheets), and how many bytes of local files each of
+    them links, so you can find the pages where bundling or splitting
+    would save the most bandwidth. Enable with WebDeps(report=True).
+
+    A page is recorded whenever its tags are output (by top_output,
+    bottom_output, lib.tags, script.tags etc.), with the requirements
+    it has at that moment; if they grow later, the page is recorded
+    again in place of the earlier count. Pages that output nothing
+    can call PageDeps.record().
+    '''
+    def __init__(self, libs, styles, path_provider=default_path_provider):
+        self.libs = libs
+        self.styles = styles
+        self.path_provider = path_provider
+        self.counts = {}  # (lib requirement, css requirement) -> requests
+        self._lock = threading.Lock()
+
+    def record(self, lib_requirement, css_requirement, previous=None):
+        '''Counts a page. `previous` is the key under which the same
+        page was counted before, if any; that count is withdrawn.
+        '''
+        key = (lib_requirement, css_requirement)
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+            if previous is not None:
+                self.counts[previous] -= 1
+                if not self.counts[previous]:
+                    del self.counts[previous]
+
+    @memoize(1000, keymaker=hashable_key, lock=True)
+    def weight(self, lib_requirement, css_requirement):
+        '''Returns the number of bytes of the local files required.'''
+        total = 0
+        for registry, bits in ((self.libs, lib_requirement),
+                               (self.styles, css_requirement)):
+            for dep in registry.summon(bits):
+                path = self.path_provider(dep)
+                if path and os.path.exists(path):
+                    total += os.path.getsize(path)
+        return total
+
+    def rows(self):
+        '''Returns a list of dictionaries, one per distinct page,
+        the pages that cost the most bandwidth first.
+        '''
+        with self._lock:
+            counts = list(self.counts.items())
+        rows = []
+        for (lib_bits, css_bits), requests in counts:
+            weight = self.weight(lib_bits, css_bits)
+            rows.append(dict(
+                libs=[d.handle for d in self.libs.summon(lib_bits)],
+                css=[d.handle for d in self.styles.summon(css_bits)],
+                requests=requests, bytes=weight, total=weight * requests))
+        rows.sort(key=lambda r: r['total'], reverse=True)
+        return rows
+
+    def text(self):
+        '''Returns the report as plain text.'''
+        return '\n'.join(['{requests:>8} requests x {bytes:>9} bytes = '
+            '{total:>11} bytes | libs: {l} | css: {c}'.format(
+                l=', '.join(r['libs']), c=', '.join(r['css']), **r)
+            for r in self.rows()])
+
+
 class PageDeps(object):
     '''Represents the dependencies of a page;
     an instance must be used on each request.
     Makes it easy to declare dependencies and provides the HTML tag soup.
     '''
-    def __init__(self, libs, styles, packages):
+    def __init__(self, libs, styles, packages, report=None, minify=False,
+                 wrap=None):
         '''The constructor is called by
         the factory returned by WebDeps.close(), not by you.
         It just assembles a composite object.
         '''
-        self.lib = PageDepsComponent(libs)
-        self.css = PageDepsComponent(styles)
-        self.script = ScriptComponent()
+        self.report = report
+        self._recorded = None  # the requirements counted in the report
+        record = self.record if report is not None else None
+        self.lib = PageDepsComponent(libs, on_output=record)
+        self.css = PageDepsComponent(styles, on_output=record)
+        self.script = ScriptComponent(minify=minify, wrap=wrap, lib=self.lib,
+                                      on_output=record)
         self.package = PackageComponent(packages, self)
 
+    def record(self):
+        '''Counts this page in the DepsReport, if there is one, with its
+        current requirements. Called whenever tags are output, so you
+        only need to call it if the page outputs none.
+        '''
+        if self.report is None:
+            return
+        key = (self.lib.requirement, self.css.requirement)
+        if key != self._recorded:
+            self.report.record(*key, previous=self._recorded)
+            self._recorded = key
+
+    def declare(self, lib=None, css=None, package=None):
+        '''Requires libs, stylesheets and packages at once.'''
+        if package:
+            self.package(package)
+        if lib:
+            self.lib(lib)
+        if css:
+            self.css(css)
+
     @property
     def top_output(self):
+        '''Returns the stylesheet tags for the <head>. Stylesheets
+        required after this (by the rest of the template) are output
+        by bottom_output instead, so the head can be flushed early.
+        '''
+        self._flushed_css = self.css.requirement
         return self.css.tags
 
+    @property
+    def late_css(self):
+        '''Returns the tags of the stylesheets required after
+        top_output was rendered.
+        '''
+        flushed = getattr(self, '_flushed_css', None)
+        if flushed is None:
+            return ''
+        late = self.css.requirement & ~flushed
+        return self.css.registry.tags(late) if late else ''
+
     @property
     def bottom_output(self):
-        return self.lib.tags + '\n' + self.script.tags
+        late_css = self.late_css
+        return (late_css + '\n' if late_css else '') + self.lib.tags + \
+            '\n' + self.script.tags
 
     def __unicode__(self):
         return '\n'.join([self.css.tags, self.lib.tags, self.script.tags])
 
+    @property
+    def preloads(self):
+        '''Returns a list of (url, rel, destination) tuples for the
+        stylesheets and then the scripts of this page, in order, as in
+        <link rel="..." as="...">. JS modules must be fetched in module
+        mode, so their rel is "modulepreload" instead of "preload".
+        '''
+        return [(url, 'preload', 'style') for url in self.css.urls] + \
+            [(url, 'modulepreload' if load == 'module' else 'preload',
+              'script') for url, load in self.lib.links]
+
+    @property
+    def link_header(self):
+        '''Returns the value of an HTTP "Link" header asking for all the
+        stylesheets and scripts of this page to be preloaded, so a browser
+        (or a reverse proxy that does HTTP/2 push or 103 Early Hints)
+        can fetch them before parsing the HTML. See preload_tween_factory.
+        '''
+        return ', '.join(['<{}>; rel={}; as={}'.format(url, rel, as_)
+                          for url, rel, as_ in self.preloads])
+
+    @property
+    def preload_tags(self):
+        '''Returns <link rel="preload"> tags for the <head>, with the same
+        effect as link_header for clients that ignore the header.
+        '''
+        return '\n'.join(['<link rel="{}" href="{}" as="{}" />'
+                          .format(rel, url, as_)
+                          for url, rel, as_ in self.preloads])
+
     def light_accordion(self, selector='.accordion', h_tag='h3'):
         '''Implements an accordion that depends on jquery only, not jquery.ui.
 